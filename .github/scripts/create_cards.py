@@ -1,5 +1,8 @@
 import os
-from trello import TrelloClient
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
+from trello import Board, TrelloClient
 from github import Github
 import json
 
@@ -16,32 +19,97 @@ board_id = os.getenv('TRELLO_BOARD_ID')
 list_name = os.getenv('TRELLO_LIST_NAME')
 github_event = os.getenv('GITHUB_EVENT_PATH')
 
+# Optional routing table: a JSON list of routes such as
+#   [{"repo": "niaid/*", "severity": "Priority: High", "board": "<board id>", "list": "On-call"},
+#    {"label": "frontend", "board": "<board id>", "list": "Backlog"}]
+# A route matches when every key it sets matches the issue: "repo" is a pattern for the repo full name,
+# "severity" and "label" are issue label names.  The issue gets a card on every matching route, or on
+# TRELLO_BOARD_ID/TRELLO_LIST_NAME when no route matches.
+routes = json.loads(os.getenv('TRELLO_ROUTES') or '[]')
+
 with open(github_event, "r") as event_file:
     event = json.load(event_file)
 
 issue_data = event["issue"]
-repo = github_client.get_repo(event["repository"]["full_name"])
-issue = repo.get_issue(number=issue_data["number"])
+repo_full_name = event["repository"]["full_name"]
 
-if "Trellaction" in [label["name"] for label in issue_data["labels"]]:
-    board = client.get_board(board_id)
+# Independent GitHub and Trello reads run concurrently on this pool, card writes on their own pool so they
+# never wait for a free reader thread.  A run costs about its longest chain of dependent calls.
+read_executor = ThreadPoolExecutor(max_workers=8)
+write_executor = ThreadPoolExecutor(max_workers=4)
 
-    # Get lists and match name to get list index.  If no matching list exists, error out
-    all_lists = board.list_lists()
-    list_index = next((index for index, tlist in enumerate(all_lists) if tlist.name == list_name), None)
-    if list_index is None:
-        print(f"Error: No list found with the name {list_name}")
-        exit(1)
+# Hidden alert fingerprint that create_issues.py appends to issue bodies, same pattern as fingerprint_pattern there.
+# Trello shows HTML comments as text, so it is removed from the card description.
+fingerprint_pattern = re.compile(r"\s*<!-- trellaction-fingerprint: (\w+) -->")
+
+
+def fetch_issue_comments():
+    issue = github_client.get_repo(repo_full_name).get_issue(number=issue_data["number"])
+    return issue, [comment.body for comment in issue.get_comments()]
+
+
+class BoardSnapshot:
+    """ Trello board whose lists, cards and labels are fetched concurrently, at most once per run """
+
+    def __init__(self, board_id):
+        # Build the board from its ID instead of fetching it, the lists, cards and labels only need the ID
+        self.board = Board(client=client, board_id=board_id)
+        self._lists = read_executor.submit(self.board.list_lists)
+        # All cards in the board, including those in the archive
+        self._cards = read_executor.submit(self.board.all_cards)
+        self._archived_card_ids = read_executor.submit(lambda: {card.id for card in self.board.closed_cards()})
+        self._labels = read_executor.submit(self.board.get_labels, limit=None)
+
+    @property
+    def lists(self):
+        return self._lists.result()
+
+    @property
+    def cards(self):
+        return self._cards.result()
+
+    @property
+    def archived_card_ids(self):
+        return self._archived_card_ids.result()
 
-    in_list = board.list_lists()[list_index]  # Get the list specified
+    @property
+    def labels(self):
+        return self._labels.result()
 
-    # Get all cards in the board, including those in the archive
-    existing_cards = board.all_cards()
-    archived_cards = board.closed_cards()
+    def find_list(self, name):
+        return next((tlist for tlist in self.lists if tlist.name == name), None)
 
-    # Get all labels in the board
-    existing_labels = board.get_labels(limit=None)
-    existing_label_names = [label.name for label in existing_labels]
+
+board_snapshots = {}
+
+def get_board_snapshot(board_id):
+    if board_id not in board_snapshots:
+        board_snapshots[board_id] = BoardSnapshot(board_id)
+    return board_snapshots[board_id]
+
+
+def route_matches(route, issue_label_names):
+    if "repo" in route and not fnmatch(repo_full_name, route["repo"]):
+        return False
+    if "severity" in route and route["severity"] not in issue_label_names:
+        return False
+    if "label" in route and route["label"] not in issue_label_names:
+        return False
+    return True
+
+def get_destinations(issue_label_names):
+    destinations = []
+    for route in routes:
+        destination = (route["board"], route["list"])
+        if route_matches(route, issue_label_names) and destination not in destinations:
+            destinations.append(destination)
+    if not destinations and board_id and list_name:
+        destinations.append((board_id, list_name))
+    return destinations
+
+
+def sync_card(snapshot, in_list, card_title, desc):
+    """ Create or update the issue card on one board and return its URL """
 
     # Prepare labels for the card and check for missing labels in Trello
     print("Preparing labels...")
@@ -50,7 +118,7 @@ if "Trellaction" in [label["name"] for label in issue_data["labels"]]:
 
     for issue_label in issue_data["labels"]:
         match_found = False
-        for trello_label in existing_labels:
+        for trello_label in snapshot.labels:
             if trello_label.name == issue_label["name"]:
                 card_labels.append(trello_label)
                 match_found = True
@@ -62,21 +130,14 @@ if "Trellaction" in [label["name"] for label in issue_data["labels"]]:
     if missing_labels:
         print(f"Warning: The following labels from the issue do not exist in Trello: {', '.join(missing_labels)}")
 
-
-    issue_link = issue_data["html_url"]
-    desc = f'{issue_data["body"]}\n\n[Link to GitHub Issue]({issue_link})'
-
-    # Including the repo name in the card's title
-    card_title = f'{event["repository"]["full_name"]}: {issue_data["title"]}'
-
     print("Checking cards...")
     # Check if a card with the same title exists
-    for card in existing_cards:
+    for card in snapshot.cards:
         if card.name == card_title:
             # If the card is closed (archived), do nothing
-            if card in archived_cards:
+            if card.id in snapshot.archived_card_ids:
                 print("Card already closed.")
-                break
+                return card.url
 
             print("Card already open. Updating description...")
             # Update the existing card
@@ -89,27 +150,75 @@ if "Trellaction" in [label["name"] for label in issue_data["labels"]]:
             for label in card_labels:
                 if label.name not in current_label_names_on_card:
                     card.add_label(label)
-            trello_card_link = card.url
-            break
-    else:
-        print("No card exists for this issue.  Creating new card...")
-        # If no existing card is found, add a new card
-        list = board.list_lists()[list_index]  # Put the card in the specified list
-        card = list.add_card(card_title, desc=desc)
-        # Add labels to the card
-        for label in card_labels:
-            card.add_label(label)
-        trello_card_link = card.url
-
-    # Add a comment to the GitHub issue with a link to the Trello card
-    repo_full_name = issue_data["repository_url"].split("https://api.github.com/repos/")[1]
-    repo = github_client.get_repo(repo_full_name)
-    issue = repo.get_issue(number=issue_data["number"])
-    comments = issue.get_comments()
-
-    # Check if a comment with a link to the Trello card already exists
-    for comment in comments:
-        if trello_card_link in comment.body:
-            break
-    else:
-        issue.create_comment(f"Related Trello card: {trello_card_link}")
\ No newline at end of file
+            return card.url
+
+    print("No card exists for this issue.  Creating new card...")
+    # If no existing card is found, add a new card in the specified list
+    card = in_list.add_card(card_title, desc=desc)
+    # Add labels to the card
+    for label in card_labels:
+        card.add_label(label)
+    return card.url
+
+
+def archive_card(snapshot, card_title):
+    for card in snapshot.cards:
+        if card.name == card_title and card.id not in snapshot.archived_card_ids:
+            print("Issue closed. Archiving card...")
+            card.set_closed(True)
+
+
+issue_label_names = [label["name"] for label in issue_data["labels"]]
+
+if "Trellaction" in issue_label_names:
+    destinations = get_destinations(issue_label_names)
+    if not destinations:
+        print("Error: No Trello board matches this issue.  Set TRELLO_BOARD_ID and TRELLO_LIST_NAME or add a route.")
+        exit(1)
+
+    # Including the repo name in the card's title
+    card_title = f'{repo_full_name}: {issue_data["title"]}'
+
+    # The issue comments are only needed at the end, start fetching them first while the cards are synced
+    closing = event.get("action") == "closed"
+    if not closing:
+        comments_future = read_executor.submit(fetch_issue_comments)
+
+    # Start loading every destination board right away
+    for destination_board_id, _ in destinations:
+        get_board_snapshot(destination_board_id)
+
+    # Archive the card of a closed issue, e.g. when its security alert was fixed or dismissed
+    if closing:
+        for destination_board_id, _ in destinations:
+            archive_card(get_board_snapshot(destination_board_id), card_title)
+        exit(0)
+
+    issue_link = issue_data["html_url"]
+    issue_body = fingerprint_pattern.sub("", issue_data["body"] or "")
+    desc = f'{issue_body}\n\n[Link to GitHub Issue]({issue_link})'
+
+    # Match every list name before writing anything.  If no matching list exists, error out
+    destination_lists = []
+    for destination_board_id, destination_list_name in destinations:
+        snapshot = get_board_snapshot(destination_board_id)
+        in_list = snapshot.find_list(destination_list_name)
+        if in_list is None:
+            print(f"Error: No list found with the name {destination_list_name} on board {destination_board_id}")
+            exit(1)
+        destination_lists.append((snapshot, in_list))
+
+    card_futures = []
+    for snapshot, in_list in destination_lists:
+        print(f"Syncing card to board {snapshot.board.id}, list {in_list.name}...")
+        card_futures.append(write_executor.submit(sync_card, snapshot, in_list, card_title, desc))
+
+    # Add a comment to the GitHub issue with a link to each Trello card as soon as it is ready, unless one
+    # already exists.  Routes that resolve to the same card share one comment.
+    issue, comment_bodies = comments_future.result()
+    for card_future in as_completed(card_futures):
+        trello_card_link = card_future.result()
+        if not any(trello_card_link in body for body in comment_bodies):
+            comment_body = f"Related Trello card: {trello_card_link}"
+            issue.create_comment(comment_body)
+            comment_bodies.append(comment_body)
@@ -0,0 +1,71 @@
+"""Connection reuse benchmark for the PostgreSQL access layer
+
+Runs the same query through a new psycopg2 connection per call and through the pooled ConnectionPool, from one
+thread and from several threads, against the database configured by the PG* environment variables.
+
+Usage:
+    PGHOST=localhost PGUSER=postgres PGPASSWORD=... python benchmarks/bench_db.py [--queries N] [--threads N]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ConnectionPool, db_config
+
+query = "select version()"
+
+def connect_per_call(config):
+    conn = psycopg2.connect(
+        host=config['host'],
+        port=config['port'],
+        database=config['database'],
+        user=config['user'],
+        password=config['password']
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+def run(label, call, queries, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(queries):
+            call()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for future in [executor.submit(call) for _ in range(queries)]:
+                future.result()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<18} {elapsed * 1000:9.1f} ms total  {elapsed / queries * 1e6:9.1f} us/query")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=500, help='queries per scenario')
+    parser.add_argument('--threads', type=int, default=8, help='worker threads for the concurrent scenario')
+    args = parser.parse_args()
+
+    config = db_config()
+    config['max_size'] = max(config['max_size'], args.threads)
+    db_pool = ConnectionPool(config)
+    db_pool.fetch_one(query)  # open the first connection outside of the timings
+
+    try:
+        for threads in (1, args.threads):
+            print(f"{args.queries} queries, {threads} thread(s):")
+            run('connect-per-call', lambda: connect_per_call(config), args.queries, threads)
+            run('pooled', lambda: db_pool.fetch_one(query), args.queries, threads)
+    finally:
+        db_pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""Offline rotation benchmark for the OpenSearch rotation Lambda
+
+Runs full four-step rotations through testfile1.lambda_handler (or batch_lambda_handler with --batch) without
+AWS or a real cluster:
+
+    FakeSecretsManager   in-process stand-in for describe_secret, get_secret_value, put_secret_value,
+                         update_secret_version_stage and get_random_password, with version staging modelled
+                         the way Secrets Manager does it
+    OpenSearchStub       local HTTPS server answering the security plugin calls the Lambda makes (authinfo,
+                         account, internalusers) against an in-memory user table
+
+Both stand-ins can inject latency, and the stub can inject server errors and stale passwords to exercise the
+failure paths. The report shows calls per rotation step, wall time per step and which rotations failed where.
+Needs the openssl command line tool to create a throwaway certificate.
+
+Usage:
+    python benchmarks/bench_rotation.py [--secrets 2000] [--workers 16] [--sm-latency-ms 5] [--os-latency-ms 10]
+                                        [--os-error-rate 0.01] [--stale-password-rate 0.01] [--batch]
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import random
+import secrets
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import testfile1
+
+steps = ['createSecret', 'setSecret', 'testSecret', 'finishSecret']
+current_step = threading.local()
+
+
+class ResourceNotFoundException(Exception):
+    """ Raise if the requested secret or secret version does not exist """
+
+
+class FakeSecretsManager:
+    """ Thread-safe in-memory Secrets Manager client
+
+    Args:
+        latency (float): seconds slept in every call
+
+    """
+
+    class exceptions:
+        ResourceNotFoundException = ResourceNotFoundException
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.default_step = 'other'
+        self.secrets = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, method):
+        # Worker threads of batch_lambda_handler have no step of their own
+        step = getattr(current_step, 'name', self.default_step)
+        with self.lock:
+            self.calls[(step, method)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_secret(self, arn, secret_dict):
+        self.secrets[arn] = {
+            'RotationEnabled': True,
+            'versions': {str(uuid.uuid4()): {'SecretString': json.dumps(secret_dict), 'stages': {'AWSCURRENT'}}}
+        }
+
+    def start_rotation(self, arn):
+        """ Stage a new AWSPENDING version without a value, like RotateSecret does before invoking the Lambda """
+        token = str(uuid.uuid4())
+        with self.lock:
+            self._move_stage(arn, 'AWSPENDING', token)
+        return token
+
+    def _move_stage(self, arn, stage, version_id):
+        versions = self.secrets[arn]['versions']
+        for version in versions.values():
+            version['stages'].discard(stage)
+        versions.setdefault(version_id, {'SecretString': None, 'stages': set()})['stages'].add(stage)
+
+    def _secret(self, arn):
+        if arn not in self.secrets:
+            raise ResourceNotFoundException(f"Secret {arn} not found")
+        return self.secrets[arn]
+
+    def current_value(self, arn):
+        versions = self.secrets[arn]['versions']
+        return next(json.loads(v['SecretString']) for v in versions.values() if 'AWSCURRENT' in v['stages'])
+
+    def describe_secret(self, SecretId):
+        self._call('describe_secret')
+        with self.lock:
+            secret = self._secret(SecretId)
+            return {
+                'ARN': SecretId,
+                'RotationEnabled': secret['RotationEnabled'],
+                'VersionIdsToStages': {vid: sorted(v['stages']) for vid, v in secret['versions'].items() if v['stages']}
+            }
+
+    def get_secret_value(self, SecretId, VersionStage='AWSCURRENT', VersionId=None):
+        self._call('get_secret_value')
+        with self.lock:
+            for vid, version in self._secret(SecretId)['versions'].items():
+                if VersionStage in version['stages'] and VersionId in (None, vid) and version['SecretString']:
+                    return {'ARN': SecretId, 'VersionId': vid, 'SecretString': version['SecretString'],
+                            'VersionStages': sorted(version['stages'])}
+        raise ResourceNotFoundException(f"Secret {SecretId} has no value for stage {VersionStage}")
+
+    def put_secret_value(self, SecretId, ClientRequestToken, SecretString, VersionStages):
+        self._call('put_secret_value')
+        with self.lock:
+            self._secret(SecretId)['versions'].setdefault(ClientRequestToken, {'stages': set()})
+            self.secrets[SecretId]['versions'][ClientRequestToken]['SecretString'] = SecretString
+            for stage in VersionStages:
+                self._move_stage(SecretId, stage, ClientRequestToken)
+        return {'ARN': SecretId, 'VersionId': ClientRequestToken, 'VersionStages': VersionStages}
+
+    def update_secret_version_stage(self, SecretId, VersionStage, MoveToVersionId=None, RemoveFromVersionId=None):
+        self._call('update_secret_version_stage')
+        with self.lock:
+            versions = self._secret(SecretId)['versions']
+            if RemoveFromVersionId and VersionStage not in versions[RemoveFromVersionId]['stages']:
+                raise ValueError(f"{VersionStage} is not attached to version {RemoveFromVersionId}")
+            if VersionStage == 'AWSCURRENT' and RemoveFromVersionId:
+                # Secrets Manager keeps the replaced version as AWSPREVIOUS and clears AWSPENDING on promotion
+                self._move_stage(SecretId, 'AWSPREVIOUS', RemoveFromVersionId)
+                versions[MoveToVersionId]['stages'].discard('AWSPENDING')
+            if MoveToVersionId is None:
+                versions[RemoveFromVersionId]['stages'].discard(VersionStage)
+            else:
+                self._move_stage(SecretId, VersionStage, MoveToVersionId)
+        return {'ARN': SecretId}
+
+    def get_random_password(self, ExcludeCharacters='', PasswordLength=32):
+        self._call('get_random_password')
+        alphabet = [c for c in (chr(i) for i in range(33, 127)) if c not in ExcludeCharacters]
+        return {'RandomPassword': ''.join(secrets.choice(alphabet) for _ in range(PasswordLength))}
+
+
+class OpenSearchStub:
+    """ Local HTTPS server answering the OpenSearch security plugin calls made by the rotation Lambda
+
+    Args:
+        latency (float): seconds slept before answering each request
+        error_rate (float): share of requests answered with 503
+
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.users = {}
+        self.admins = set()
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ca_file = os.path.join(self.tmpdir.name, 'cert.pem')
+        key_file = os.path.join(self.tmpdir.name, 'key.pem')
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+             '-addext', 'subjectAltName=DNS:localhost', '-keyout', key_file, '-out', self.ca_file],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.ca_file, key_file)
+        self.server = ThreadingHTTPServer(('localhost', 0), self._handler())
+        self.server.daemon_threads = True
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.endpoint = f"localhost:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.tmpdir.cleanup()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                path = self.path.split('?')[0]
+                route = 'internalusers' if '/internalusers/' in path else path.rsplit('/', 1)[-1]
+                with stub.lock:
+                    stub.calls[(self.command, route)] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    return self._reply(503, {'error': 'injected failure'})
+
+                login, _, password = base64.b64decode(
+                    self.headers.get('Authorization', 'Basic ').split(' ', 1)[1] or b'').decode().partition(':')
+                with stub.lock:
+                    if stub.users.get(login) != password:
+                        return self._reply(401, {'error': 'Unauthorized'})
+                    if route == 'authinfo' and self.command == 'GET':
+                        return self._reply(200, {'user_name': login})
+                    if route == 'account' and self.command == 'PUT':
+                        if body.get('current_password') != password:
+                            return self._reply(400, {'status': 'BAD_REQUEST', 'message': 'Could not validate your current password.'})
+                        stub.users[login] = body['password']
+                        return self._reply(200, {'status': 'OK', 'message': "'account' updated."})
+                    if route == 'internalusers' and self.command == 'PATCH':
+                        if login not in stub.admins:
+                            return self._reply(403, {'error': 'Forbidden'})
+                        user = path.rsplit('/', 1)[-1]
+                        stub.users[user] = body[0]['value']
+                        return self._reply(200, {'status': 'OK', 'message': "Resource updated."})
+                return self._reply(404, {'error': f"no handler for {self.command} {path}"})
+
+            do_GET = do_PUT = do_PATCH = _handle
+
+        return Handler
+
+
+class FakeContext:
+    """ Lambda context with a fixed time budget per invocation """
+
+    def __init__(self, budget_ms):
+        self.deadline = time.monotonic() + budget_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def rotate(sm, arn, step_times, budget_ms):
+    """ Drive one rotation through the four lambda_handler steps, return the failed step or None """
+    token = sm.start_rotation(arn)
+    for step in steps:
+        current_step.name = step
+        start = time.perf_counter()
+        try:
+            testfile1.lambda_handler({'SecretId': arn, 'ClientRequestToken': token, 'Step': step}, FakeContext(budget_ms))
+        except Exception:
+            return step
+        finally:
+            step_times[step].append(time.perf_counter() - start)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--secrets', type=int, default=2000, help='number of secrets to rotate')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent Lambda invocations')
+    parser.add_argument('--sm-latency-ms', type=float, default=5, help='latency added to every Secrets Manager call')
+    parser.add_argument('--os-latency-ms', type=float, default=10, help='latency added to every OpenSearch request')
+    parser.add_argument('--os-error-rate', type=float, default=0.0, help='share of OpenSearch requests failing with 503')
+    parser.add_argument('--stale-password-rate', type=float, default=0.0,
+                        help='share of users whose cluster password no longer matches AWSCURRENT')
+    parser.add_argument('--budget-ms', type=int, default=30000, help='Lambda time budget per invocation')
+    parser.add_argument('--batch', action='store_true', help='rotate through batch_lambda_handler instead')
+    parser.add_argument('--batch-runs', type=int, default=1,
+                        help='with --batch, invoke the handler up to this many times, until no secret is left failed')
+    parser.add_argument('--verbose', action='store_true', help='keep the Lambda INFO logs')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL + 1)
+
+    rng = random.Random(0)
+    sm = FakeSecretsManager(args.sm_latency_ms / 1000)
+    stub = OpenSearchStub(args.os_latency_ms / 1000, args.os_error_rate).start()
+    # requests reads the CA bundle from the environment, so the Lambda code trusts the stub as is
+    os.environ['REQUESTS_CA_BUNDLE'] = stub.ca_file
+    testfile1._sm_client = sm
+
+    admin_arn = 'arn:secret:admin'
+    stub.users['admin'] = 'admin-password'
+    stub.admins.add('admin')
+    sm.add_secret(admin_arn, {'endpoint': stub.endpoint, 'login': 'admin', 'password': 'admin-password',
+                              'master_secret': 'self'})
+    arns = []
+    for i in range(args.secrets):
+        arn = f"arn:secret:user-{i}"
+        password = secrets.token_urlsafe(16)
+        stub.users[f"user-{i}"] = 'stale' if rng.random() < args.stale_password_rate else password
+        sm.add_secret(arn, {'endpoint': stub.endpoint, 'login': f"user-{i}", 'password': password,
+                            'master_secret': admin_arn})
+        arns.append(arn)
+
+    step_times = defaultdict(list)
+    failures = Counter()
+    start = time.perf_counter()
+    if args.batch:
+        sm.default_step = 'batch'
+        pending = arns
+        for run in range(1, args.batch_runs + 1):
+            results = testfile1.batch_lambda_handler({'SecretIds': pending, 'MaxConcurrencyPerCluster': args.workers},
+                                                     FakeContext(args.budget_ms * len(arns)))
+            statuses = Counter(result['Status'] for result in results)
+            print(f"Batch run {run}: " + ", ".join(f"{count} {status.lower()}" for status, count in sorted(statuses.items())))
+            pending = [result['SecretId'] for result in results if result['Status'] != 'Rotated']
+            if not pending:
+                break
+        failures.update('batch' for _ in pending)
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for failed_step in executor.map(lambda arn: rotate(sm, arn, step_times, args.budget_ms), arns):
+                if failed_step:
+                    failures[failed_step] += 1
+    wall = time.perf_counter() - start
+    stub.stop()
+
+    # A secret is consistent when the cluster accepts the password stored as AWSCURRENT
+    inconsistent = sum(1 for i, arn in enumerate(arns) if stub.users[f"user-{i}"] != sm.current_value(arn)['password'])
+
+    mode = 'batch_lambda_handler' if args.batch else f"lambda_handler, {args.workers} workers"
+    print(f"Rotated {args.secrets} secrets ({mode}) in {wall:.2f}s, {args.secrets / wall:.1f} secrets/s")
+    print("\nSecrets Manager calls per step:")
+    for (step, method), count in sorted(sm.calls.items()):
+        print(f"  {step:<14} {method:<28} {count:>8}  ({count / args.secrets:.2f} per secret)")
+    print("\nOpenSearch requests:")
+    for (method, route), count in sorted(stub.calls.items()):
+        print(f"  {method:<6} {route:<36} {count:>8}")
+    if step_times:
+        print("\nWall time per step:")
+        for step in steps:
+            times = sorted(step_times[step])
+            if times:
+                print(f"  {step:<14} mean {sum(times) / len(times) * 1000:8.2f} ms  "
+                      f"p99 {times[int(len(times) * 0.99) - 1 if len(times) > 1 else 0] * 1000:8.2f} ms  n={len(times)}")
+    print("\nFailures:")
+    for step, count in sorted(failures.items()):
+        print(f"  {step:<14} {count:>8}")
+    print(f"  {'total':<14} {sum(failures.values()):>8}")
+    print(f"\nSecrets whose AWSCURRENT password is not accepted by the cluster: {inconsistent}")
+
+
+if __name__ == '__main__':
+    main()
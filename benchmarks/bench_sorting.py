@@ -0,0 +1,89 @@
+"""Sorting benchmark
+
+Compares the algorithms of the sorting module with the original recursive insertion sort and the built-in
+list.sort across input sizes and orderings. Quadratic algorithms are skipped above a size cap, and the
+recursive sort is skipped where it would exceed the recursion limit.
+
+Usage:
+    python benchmarks/bench_sorting.py [--sizes 100,1000,10000,100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sorting
+
+def insertion_sort_recursive(arr, n):
+    # The original implementation, kept here as the baseline
+    if n <= 1:
+        return
+    insertion_sort_recursive(arr, n - 1)
+    last = arr[n - 1]
+    j = n - 2
+    while (j >= 0 and arr[j] > last):
+        arr[j + 1] = arr[j]
+        j = j - 1
+    arr[j + 1] = last
+
+def nearly_sorted(n, rng):
+    data = list(range(n))
+    for _ in range(max(1, n // 100)):
+        i, j = rng.randrange(n), rng.randrange(n)
+        data[i], data[j] = data[j], data[i]
+    return data
+
+orderings = {
+    'random': lambda n, rng: [rng.random() for _ in range(n)],
+    'sorted': lambda n, rng: list(range(n)),
+    'reversed': lambda n, rng: list(range(n, 0, -1)),
+    'nearly sorted': nearly_sorted,
+    'few unique': lambda n, rng: [rng.randrange(8) for _ in range(n)],
+    'strings': lambda n, rng: [f"{rng.randrange(10 ** 6):06d}" for _ in range(n)],
+}
+
+# name: (sort function, largest size it is run on)
+algorithms = {
+    'recursive (original)': (lambda arr: insertion_sort_recursive(arr, len(arr)), 900),
+    'binary insertion': (sorting.binary_insertion_sort, 20000),
+    'merge': (sorting.merge_sort, None),
+    'numpy': (sorting.numpy_sort, None),
+    'sort_in_place': (sorting.sort_in_place, None),
+    'list.sort': (list.sort, None),
+}
+
+def time_sort(sort, data, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        arr = list(data)
+        start = time.perf_counter()
+        sort(arr)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help='comma separated input sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is kept')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    rng = random.Random(0)
+
+    print(f"{'ordering':<14} {'size':>7}  " + "  ".join(f"{name:>20}" for name in algorithms))
+    for ordering, generate in orderings.items():
+        for size in sizes:
+            data = generate(size, rng)
+            cells = []
+            for name, (sort, max_size) in algorithms.items():
+                if (max_size is not None and size > max_size) or (name == 'numpy' and ordering == 'strings'):
+                    cells.append(f"{'-':>20}")
+                    continue
+                cells.append(f"{time_sort(sort, data, args.repeat) * 1000:17.3f} ms")
+            print(f"{ordering:<14} {size:>7}  " + "  ".join(cells))
+
+if __name__ == '__main__':
+    main()
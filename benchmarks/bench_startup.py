@@ -0,0 +1,76 @@
+"""Startup benchmark for the OpenSearch rotation Lambda
+
+Measures, in a fresh interpreter per run, how long it takes to import the rotation module and to serve the
+first invocation. The first invocation is the cheapest real path: a describe_secret call (answered by a
+botocore Stubber, so no AWS access is needed) for a version that is already AWSCURRENT, which returns early.
+The Secrets Manager client construction and any deferred imports are included in the first-call time.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--module testfile1]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+run_once = """
+import json
+import time
+start = time.perf_counter()
+import {module} as rotation
+imported = time.perf_counter()
+
+# Client construction (and the boto3 import, when it is deferred) counts towards the first call
+from botocore.stub import Stubber
+token = '0' * 32
+sm_client = rotation.get_sm_client() if hasattr(rotation, 'get_sm_client') else rotation.sm_client
+stubber = Stubber(sm_client)
+stubber.add_response('describe_secret', {{
+    'RotationEnabled': True,
+    'VersionIdsToStages': {{token: ['AWSCURRENT']}}
+}})
+stubber.activate()
+rotation.lambda_handler({{'SecretId': 'arn', 'ClientRequestToken': token, 'Step': 'createSecret'}}, None)
+done = time.perf_counter()
+
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'first_call_ms': (done - imported) * 1000}}))
+"""
+
+def measure(module, runs):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', run_once.format(module=module)],
+            cwd=repo_root, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            sys.exit(f"Benchmark run failed:\n{result.stderr}")
+        output = result.stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='number of fresh interpreters to start')
+    parser.add_argument('--module', default='testfile1', help='rotation module to benchmark')
+    args = parser.parse_args()
+
+    samples = measure(args.module, args.runs)
+    print(f"Module: {args.module} ({args.runs} runs)")
+    for key in ('import_ms', 'first_call_ms'):
+        values = [sample[key] for sample in samples]
+        print(f"  {key:<14} median {statistics.median(values):8.2f}  min {min(values):8.2f}  max {max(values):8.2f}")
+    total = [sample['import_ms'] + sample['first_call_ms'] for sample in samples]
+    print(f"  {'total_ms':<14} median {statistics.median(total):8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,21 @@
 import os
+import re
+import time
+import atexit
+import hashlib
 import requests
 import json
-from github import Github
+import csv
+import heapq
+from array import array
+from datetime import datetime, timezone
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from github import Github, UnknownObjectException
 
 token = os.getenv("REPO_TOKEN")
-g = Github(token)
+# 100 items per page, the API maximum, to list issues and alerts in as few calls as possible
+g = Github(token, per_page=100)
 headers = {"Authorization": f"Bearer {token}"}
 
 owner, repo_name = os.getenv("GITHUB_REPOSITORY").split("/")
@@ -12,34 +23,62 @@ repo = g.get_repo(f"{owner}/{repo_name}")
 
 # Get Dependabot alerts
 
-query = f"""
-{{
-  repository(owner:"{owner}", name:"{repo_name}") {{
-    vulnerabilityAlerts(first: 100) {{
-      nodes {{
+query = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    vulnerabilityAlerts(first: 100, after: $cursor) {
+      nodes {
         number
         state
         createdAt
         dismissedAt
-        securityVulnerability {{
-          package {{
+        securityVulnerability {
+          package {
             name
-          }}
-          advisory {{
+          }
+          advisory {
             description
-          }}
+          }
           severity
-        }}
-      }}
-    }}
-  }}
-}}
+        }
+      }
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+    }
+  }
+}
 """
 
-response = requests.post('https://api.github.com/graphql', headers=headers, json={'query': query})
-data = response.json()
+# Stream the alerts page by page, so repos with more than 100 alerts are fully covered.  Each alert comes with
+# the cursor its page was requested with, which is where a resumed run restarts.
+def get_dependabot_alerts(cursor=None):
+  while True:
+    variables = {"owner": owner, "name": repo_name, "cursor": cursor}
+    response = requests.post('https://api.github.com/graphql', headers=headers, json={'query': query, 'variables': variables})
+    data = response.json()
+    page = data["data"]["repository"]["vulnerabilityAlerts"]
+    for node in page["nodes"]:
+      yield cursor, node
+    if not page["pageInfo"]["hasNextPage"]:
+      break
+    cursor = page["pageInfo"]["endCursor"]
+
+count_query = """
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    vulnerabilityAlerts {
+      totalCount
+    }
+  }
+}
+"""
 
-alerts = data["data"]["repository"]["vulnerabilityAlerts"]["nodes"]
+def count_dependabot_alerts():
+  variables = {"owner": owner, "name": repo_name}
+  response = requests.post('https://api.github.com/graphql', headers=headers, json={'query': count_query, 'variables': variables})
+  return response.json()["data"]["repository"]["vulnerabilityAlerts"]["totalCount"]
 
 custom_labels_env = os.getenv("CUSTOM_LABELS", "")
 custom_labels = [label.strip() for label in os.getenv("CUSTOM_LABELS", "").split(",")] + ["Trellaction"]
@@ -48,6 +87,7 @@ print(custom_labels)
 severity_prefix = os.getenv("PRIORITY_PREFIX", "").strip()
 
 dep_created_issues = []
+dep_updated_issues = []
 dep_skipped_issues = []
 
 # Define the mapping dictionary
@@ -60,97 +100,613 @@ severity_mapping = {
 def convert_severity(severity):
     return severity_mapping.get(severity.lower(), severity)
 
-for alert in alerts:
+def get_severity_label(severity):
+  if severity_prefix:
+    return f"{severity_prefix} {severity}"
+  return severity
+
+# Every label this script may have set as a severity, so a changed severity replaces the old label
+severity_labels = {get_severity_label(severity) for severity in ["Low", "Medium", "High", "None"]}
+
+# Each issue body ends with a hidden fingerprint of the alert it was rendered from.  An issue is only
+# edited when the fingerprint of the current alert differs, so updates scale with alert churn.
+# create_cards.py strips the marker with the same pattern before copying the body to the Trello card, whose
+# markdown would otherwise show it as text.
+fingerprint_pattern = re.compile(r"<!-- trellaction-fingerprint: (\w+) -->")
+
+def alert_fingerprint(fields):
+  normalized = json.dumps(fields, sort_keys=True, default=str)
+  return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+def with_fingerprint(body, fingerprint):
+  return f"{body}\n\n<!-- trellaction-fingerprint: {fingerprint} -->"
+
+def issue_fingerprint(issue):
+  match = fingerprint_pattern.search(issue.body or "")
+  return match.group(1) if match else None
+
+def update_issue(issue, body, severity_label):
+  labels = [label.name for label in issue.labels if label.name not in severity_labels] + [severity_label]
+  issue.edit(body=body, labels=labels)
+
+# Optional export of the normalized alerts, with the issue and Trello card they map to, so dashboards can
+# read a file instead of polling the API.  Records are written as the alerts stream past.
+export_path = os.getenv("EXPORT_PATH", "").strip()
+export_format = os.getenv("EXPORT_FORMAT", "").strip().lower() or os.path.splitext(export_path)[1].lstrip(".") or "jsonl"
+# Reading the card links costs one extra API call per issue, so it is opt-in
+export_card_links = os.getenv("EXPORT_CARD_LINKS", "").lower() in ("1", "true", "yes")
+card_link_pattern = re.compile(r"Related Trello card: (\S+)")
+
+class AlertRecord:
+  # severity is the label bucket (critical alerts are labelled High), raw_severity what GitHub reported
+  __slots__ = ("source", "alert_number", "state", "severity", "raw_severity", "subject", "title", "url", "created_at",
+               "dismissed_at", "location", "issue_number", "card_url")
+
+  def __init__(self, **fields):
+    for name in self.__slots__:
+      setattr(self, name, fields.get(name))
+
+  def as_dict(self):
+    return {name: getattr(self, name) for name in self.__slots__}
+
+def export_timestamp(value):
+  """ ISO-8601 UTC form (2024-01-01T00:00:00Z) of a GraphQL timestamp string or a datetime, as exported """
+  if value is None:
+    return None
+  if isinstance(value, str):
+    value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+  if value.tzinfo is None:
+    # PyGithub returns naive datetimes in UTC on older versions
+    value = value.replace(tzinfo=timezone.utc)
+  return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class JsonlExporter:
+  def __init__(self, path):
+    self.file = open(path, "w")
+
+  def write(self, record):
+    self.file.write(json.dumps(record.as_dict(), default=str) + "\n")
+
+  def close(self):
+    self.file.close()
+
+class CsvExporter:
+  def __init__(self, path):
+    self.file = open(path, "w", newline="")
+    self.writer = csv.writer(self.file)
+    self.writer.writerow(AlertRecord.__slots__)
+
+  def write(self, record):
+    self.writer.writerow([getattr(record, name) for name in AlertRecord.__slots__])
+
+  def close(self):
+    self.file.close()
+
+class ParquetExporter:
+  # Buffers one row group in columns (numbers in arrays, text in lists) and flushes it when full,
+  # so memory stays bounded however many alerts the org has
+  int_columns = ("alert_number", "issue_number")
+  timestamp_columns = ("created_at", "dismissed_at")
+
+  def __init__(self, path, row_group_size=10000):
+    import pyarrow
+    import pyarrow.parquet
+    self.pa = pyarrow
+    self.row_group_size = row_group_size
+    self.schema = pyarrow.schema([(name, self._column_type(name)) for name in AlertRecord.__slots__])
+    self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+    self._reset()
+
+  def _column_type(self, name):
+    if name in self.int_columns:
+      return self.pa.int64()
+    if name in self.timestamp_columns:
+      return self.pa.timestamp("s", tz="UTC")
+    return self.pa.string()
+
+  def _reset(self):
+    self.columns = {name: array("q") if name in self.int_columns else [] for name in AlertRecord.__slots__}
+    self.missing_issue_numbers = []
+
+  def write(self, record):
+    for name in AlertRecord.__slots__:
+      value = getattr(record, name)
+      if name == "issue_number" and value is None:
+        self.missing_issue_numbers.append(len(self.columns[name]))
+        value = 0
+      if name in self.timestamp_columns and value is not None:
+        value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+      elif name not in self.int_columns and value is not None:
+        value = str(value)
+      self.columns[name].append(value)
+    if len(self.columns["alert_number"]) >= self.row_group_size:
+      self.flush()
+
+  def flush(self):
+    if not len(self.columns["alert_number"]):
+      return
+    arrays = []
+    for name in AlertRecord.__slots__:
+      column = self.columns[name]
+      if name == "issue_number":
+        mask = [False] * len(column)
+        for index in self.missing_issue_numbers:
+          mask[index] = True
+        arrays.append(self.pa.array(column, type=self.pa.int64(), mask=self.pa.array(mask)))
+      else:
+        arrays.append(self.pa.array(column, type=self._column_type(name)))
+    self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+    self._reset()
+
+  def close(self):
+    self.flush()
+    self.writer.close()
+
+exporters = {"jsonl": JsonlExporter, "json": JsonlExporter, "csv": CsvExporter, "parquet": ParquetExporter}
+# Opened once the preflight check let the run go ahead
+exporter = None
+skipped_card_links = 0
+
+def open_exporter():
+  global exporter
+  if export_path:
+    exporter = exporters[export_format](export_path)
+
+def close_exporter():
+  global exporter
+  if exporter is None:
+    return
+  # Also runs on early exits, a Parquet file is only readable once its footer is written
+  exporter.close()
+  exporter = None
+  print(f"Exported alerts to {export_path}")
+  if skipped_card_links:
+    print(f"Warning: The card links of {skipped_card_links} alerts were not read because the rate limit ran low")
+
+def get_card_url(issue):
+  for comment in issue.get_comments():
+    match = card_link_pattern.search(comment.body)
+    if match:
+      return match.group(1)
+  return None
+
+def export_alert(issue, budgeted=True, **fields):
+  """ Write the record of an alert.  Card links of alerts this run did not budget for are only read while the
+  rate limit allows it. """
+  global skipped_card_links
+  if exporter is None:
+    return
+  if issue is not None:
+    fields["issue_number"] = issue.number
+    if export_card_links and (budgeted or out_of_budget() is None):
+      fields["card_url"] = get_card_url(issue)
+    elif export_card_links:
+      skipped_card_links += 1
+  exporter.write(AlertRecord(**fields))
+
+# Checkpoints: with STATE_FILE set, progress is saved every CHECKPOINT_INTERVAL alerts and when the run exits,
+# so a run stopped by the rate limit or the job timeout is resumed by the next run instead of starting over.
+state_file = os.getenv("STATE_FILE", "").strip()
+checkpoint_interval = int(os.getenv("CHECKPOINT_INTERVAL", "25"))
+# Core API calls left untouched for other jobs sharing the token
+rate_limit_reserve = int(os.getenv("RATE_LIMIT_RESERVE", "100"))
+# Stop and defer the remaining alerts after this many seconds, to finish before the job timeout.  0 disables it.
+max_run_seconds = float(os.getenv("MAX_RUN_SECONDS", "0"))
+started_at = time.monotonic()
+
+def load_state():
+  fresh = {"dependabot_cursor": None, "dependabot_done": False, "processed": [], "created_issues": [],
+           "complete": False}
+  if not state_file or not os.path.exists(state_file):
+    return fresh
+  with open(state_file, "r") as f:
+    saved = json.load(f)
+  if saved.get("complete"):
+    # The previous pass went through every alert, start a new one
+    return fresh
+  return {**fresh, **saved}
+
+run_state = load_state()
+processed_alerts = set(run_state["processed"])
+# Alerts whose issue is queued for closing.  They only count as processed once the issue is closed.
+pending_closes = set()
+# Cursors of the Dependabot pages listed by this run, and the page of every alert not processed yet.  A resumed
+# run lists again from the first page that still has work left.
+dependabot_pages = []
+unfinished_dependabot = {}
+
+def save_state():
+  if not state_file:
+    return
+  if unfinished_dependabot:
+    run_state["dependabot_cursor"] = dependabot_pages[min(unfinished_dependabot.values())]
+  run_state["processed"] = sorted(processed_alerts)
+  if os.path.dirname(state_file):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+  # Write then rename, so an interrupted write never leaves a truncated state file
+  with open(f"{state_file}.tmp", "w") as f:
+    json.dump(run_state, f)
+  os.replace(f"{state_file}.tmp", state_file)
+
+# Also runs when the script dies on an exception or is interrupted
+atexit.register(save_state)
+
+alerts_since_checkpoint = 0
+
+def mark_processed(alert_key):
+  processed_alerts.add(alert_key)
+  unfinished_dependabot.pop(alert_key, None)
+
+def finish_alert(alert_key):
+  global alerts_since_checkpoint
+  if alert_key not in pending_closes:
+    mark_processed(alert_key)
+  alerts_since_checkpoint += 1
+  if alerts_since_checkpoint >= checkpoint_interval:
+    save_state()
+    alerts_since_checkpoint = 0
+
+# Cost in core API calls: an alert needs at most one create or edit call, plus one to read the card link when
+# exporting, and closing an issue takes two
+alert_cost = 2 if export_card_links else 1
+close_cost = 2
+
+def out_of_budget():
+  """ Return why the remaining alerts must wait for the next run, or None """
+  # Kept up to date from the headers of every REST response
+  remaining = g.rate_limiting[0] - rate_limit_reserve
+  # Leave enough for this alert and for every queued close, so the issues of processed alerts always get closed
+  if remaining < alert_cost + close_cost * (len(pending_closes) + 1):
+    return "the rate limit is almost used up"
+  if max_run_seconds and time.monotonic() - started_at > max_run_seconds:
+    return f"the run exceeded {max_run_seconds:g} seconds"
+  return None
+
+if processed_alerts or run_state["dependabot_done"]:
+  print(f"Resuming the previous run, {len(processed_alerts)} alerts already processed")
+
+# Only open alerts are listed, the issues of fixed and dismissed ones are closed below because their alert is no
+# longer in the list.  The optional filters narrow the list further on the server.
+codeql_tool_name = os.getenv("CODEQL_TOOL_NAME", "").strip()
+codeql_severity = os.getenv("CODEQL_SEVERITY", "").strip().lower()
+codeql_filters = {"state": "open"}
+if codeql_tool_name:
+  codeql_filters["tool_name"] = codeql_tool_name
+if codeql_severity:
+  codeql_filters["severity"] = codeql_severity
+
+# Preflight: estimate the cost of the run from the current alert counts, and defer the whole run when there is not
+# even enough budget to get started.  Counting costs one GraphQL point and one core call (a CodeQL page of one).
+rate_limit = g.get_rate_limit().resources
+print(f"Rate limit: {rate_limit.core.remaining} core calls and {rate_limit.graphql.remaining} GraphQL points left, "
+      f"core resets at {rate_limit.core.reset}")
+if rate_limit.graphql.remaining < 1 or rate_limit.core.remaining - rate_limit_reserve < 1:
+  print("Not enough rate limit left to count the alerts.  Deferring the run.")
+  exit(0)
+list_dependabot = bool(export_path) or not run_state["dependabot_done"]
+dependabot_count = count_dependabot_alerts() if list_dependabot else 0
+codeql_count = repo.get_codescan_alerts(**codeql_filters).totalCount
+processed_dependabot = sum(1 for alert_key in processed_alerts if alert_key.startswith("dependabot:"))
+estimated_alerts = (max(dependabot_count - processed_dependabot, 0) +
+                    max(codeql_count - (len(processed_alerts) - processed_dependabot), 0))
+# Listing the open issues and the CodeQL alerts takes one core call per page of 100, the Dependabot alerts one
+# GraphQL point per page of 100.  open_issues_count includes pull requests, so it errs on the high side.
+listing_cost = (repo.open_issues_count // 100 + 1) + (codeql_count // 100 + 1)
+graphql_cost = dependabot_count // 100 + 1 if list_dependabot else 0
+estimated_cost = listing_cost + estimated_alerts * alert_cost
+core_budget = rate_limit.core.remaining - rate_limit_reserve - 1
+print(f"Found {dependabot_count} Dependabot alerts to list and {codeql_count} open CodeQL alerts, "
+      f"{repo.open_issues_count} open issues and pull requests")
+print(f"Estimated cost: {estimated_cost} core calls and {graphql_cost} GraphQL points for {estimated_alerts} alerts")
+if estimated_cost > core_budget or graphql_cost > rate_limit.graphql.remaining - 1:
+  print("Warning: The estimated cost exceeds the budget, alerts left when it runs out are deferred to the next run")
+if core_budget < listing_cost + alert_cost or (list_dependabot and rate_limit.graphql.remaining < 2):
+  print("Not enough rate limit left to make progress.  Deferring the run.")
+  exit(0)
+
+open_exporter()
+atexit.register(close_exporter)
+
+# The export covers every alert, so a resumed run still lists the Dependabot alerts processed before.  Only the
+# GraphQL cost grows, the processed alerts are skipped.
+if export_path:
+  alerts = get_dependabot_alerts()
+elif not run_state["dependabot_done"]:
+  alerts = get_dependabot_alerts(run_state["dependabot_cursor"])
+else:
+  alerts = []
+
+# Fetch the open issues once instead of once per alert
+open_issues = {issue.title: issue for issue in repo.get_issues(state="open")}
+
+# Issues whose alert was fixed or dismissed, closed in one batch at the end of the run
+close_concurrency = int(os.getenv("CLOSE_CONCURRENCY", "4"))
+issues_to_close = []
+
+def queue_close(issue_title, reason, state_reason, alert_key):
+  issue = open_issues.pop(issue_title, None)
+  if issue:
+    issues_to_close.append((issue, reason, state_reason, alert_key))
+    pending_closes.add(alert_key)
+
+def close_issue(item):
+  issue, reason, state_reason, alert_key = item
+  issue.create_comment(reason)
+  issue.edit(state="closed", state_reason=state_reason)
+  return issue.number
+
+# Alerts of both sources are queued by severity and dispatched most severe first, so on a large run a critical
+# alert gets its issue, and then its Trello card, before the backlog of low ones.  Within a severity the alerts
+# keep the order of the API.
+severity_buckets = ["Critical", "High", "Medium", "Low", "None"]
+# Optional latency objective per bucket, in seconds from the start of the run, e.g. {"Critical": 60, "High": 600}
+severity_slo_seconds = json.loads(os.getenv("SEVERITY_SLO_SECONDS") or "{}")
+
+def severity_bucket(raw_severity):
+  # convert_severity folds critical into high for the labels, the queue still puts critical alerts first
+  if str(raw_severity).lower() == "critical":
+    return "Critical"
+  severity = convert_severity(str(raw_severity)).title()
+  return severity if severity in severity_buckets else "None"
+
+def raw_severity(severity):
+  # The severity as GitHub reported it, lower-cased so both sources agree, e.g. "critical"
+  return str(severity).lower() if severity is not None else None
+
+alert_queue = []
+queue_order = count()
+
+def enqueue_alert(bucket, alert_key, handler, alert):
+  heapq.heappush(alert_queue, (severity_buckets.index(bucket), next(queue_order), bucket, alert_key, handler, alert))
+
+def dependabot_fields(alert):
+  """ Normalized fields of a Dependabot alert, as exported """
   alert_id = alert["number"]
-  state = alert["state"]
-  severity = convert_severity(str(alert["securityVulnerability"]["severity"])).title()
   package_name = alert["securityVulnerability"]["package"]["name"]
-  description = alert["securityVulnerability"]["advisory"]["description"]
+  return {
+    "source": "dependabot", "alert_number": alert_id, "state": alert["state"].lower(),
+    "severity": convert_severity(str(alert["securityVulnerability"]["severity"])).title(),
+    "raw_severity": raw_severity(alert["securityVulnerability"]["severity"]), "subject": package_name,
+    "title": f"Dependabot Alert #{alert_id} - {package_name} is vulnerable",
+    "url": f"https://github.com/{owner}/{repo_name}/security/dependabot/{alert_id}",
+    "created_at": export_timestamp(alert["createdAt"]), "dismissed_at": export_timestamp(alert["dismissedAt"])
+  }
 
-  if severity_prefix:
-    severity_label = f"{severity_prefix} {severity}"
-  else: 
-    severity_label = severity
+def export_unprocessed_alert(alert_key, alert):
+  """ Export an alert this run does not process, with the issue it already has """
+  fields = dependabot_fields(alert) if alert_key.startswith("dependabot:") else codeql_fields(alert)
+  export_alert(open_issues.get(fields["title"]), budgeted=False, **fields)
+
+def process_dependabot_alert(alert, alert_key):
+  """ Create, update or close the issue of a Dependabot alert and return whether a new issue was created """
+  fields = dependabot_fields(alert)
+  alert_id = alert["number"]
+  state = alert["state"]
+  severity = fields["severity"]
+  package_name = fields["subject"]
+  description = alert["securityVulnerability"]["advisory"]["description"]
+  severity_label = get_severity_label(severity)
 
   # Create a title for the issue
-  issue_title = f"Dependabot Alert #{alert_id} - {package_name} is vulnerable"
+  issue_title = fields["title"]
+  alert_url = fields["url"]
+  fingerprint = alert_fingerprint([severity_label, package_name, description])
+  issue_body = with_fingerprint(f"{description}\n\n[Dependabot Alert Link]({alert_url})", fingerprint)
 
   # Check if an issue already exists
-  issue_exists = any(issue.title == issue_title for issue in repo.get_issues(state="open"))
-  if issue_exists or state != 'OPEN':
+  existing_issue = open_issues.get(issue_title)
+  if state != 'OPEN':
+    state_reason = "not_planned" if state in ("DISMISSED", "AUTO_DISMISSED") else "completed"
+    queue_close(issue_title, f"Closing: [Dependabot alert #{alert_id}]({alert_url}) is {state.lower().replace('_', ' ')}.", state_reason,
+                alert_key)
     dep_skipped_issues.append(alert_id)
+  elif existing_issue:
+    if issue_fingerprint(existing_issue) != fingerprint:
+      update_issue(existing_issue, issue_body, severity_label)
+      dep_updated_issues.append(alert_id)
+    else:
+      dep_skipped_issues.append(alert_id)
   else:
     # Create a new issue
-    alert_url = f"https://github.com/{owner}/{repo_name}/security/dependabot/{alert_id}"
     print(f"Severity: {severity_label} Labels: {custom_labels}")
-    repo.create_issue(
+    open_issues[issue_title] = repo.create_issue(
       title=issue_title,
-      body=f"{description}\n\n[Dependabot Alert Link]({alert_url})",
+      body=issue_body,
       labels=[severity_label] + custom_labels
     )
     dep_created_issues.append(alert_id)
+    run_state["created_issues"].append(open_issues[issue_title].number)
 
-print(f"Created issue IDs: {dep_created_issues}")
-print(f"Skipped issue IDs: {dep_skipped_issues}")
+  export_alert(open_issues.get(issue_title) or existing_issue, **fields)
+  return state == 'OPEN' and existing_issue is None
+
+for page_cursor, alert in alerts:
+  alert_key = f"dependabot:{alert['number']}"
+  if not dependabot_pages or dependabot_pages[-1] != page_cursor:
+    dependabot_pages.append(page_cursor)
+  if alert_key in processed_alerts:
+    export_unprocessed_alert(alert_key, alert)
+    continue
+  unfinished_dependabot[alert_key] = len(dependabot_pages) - 1
+  enqueue_alert(severity_bucket(alert["securityVulnerability"]["severity"]), alert_key, process_dependabot_alert, alert)
 
 # Get CodeQL alerts
 
-codescan_alerts = repo.get_codescan_alerts()
+codescan_alerts = repo.get_codescan_alerts(**codeql_filters)
 
 scan_created_issues = []
+scan_updated_issues = []
 scan_skipped_issues = []
 
-for alert in codescan_alerts:
-  alert_id = alert.number
-  created_at = alert.created_at
-  dismissed_at = alert.dismissed_at
-  tool_name = alert.tool.name
-  tool_version = alert.tool.version
-  tool_guid = alert.tool.guid
-  rule_name = alert.rule.name
-  rule_severity_level = alert.rule.security_severity_level
-  rule_severity = alert.rule.severity
-  rule_description = alert.rule.description
-  recent_instance_ref = alert.most_recent_instance.ref
-  recent_instance_state = alert.most_recent_instance.state
-  location = alert.most_recent_instance.location
-  message_text = alert.most_recent_instance.message['text']
-  severity = convert_severity(str(rule_severity_level)).title()
-
-  if severity_prefix:
-    severity_label = f"{severity_prefix} {severity}"
-  else:
-    severity_label = severity
+# The details are only read when an issue has to be compared, updated or created
+def codeql_fingerprint(alert):
+  rule = alert.rule
+  instance = alert.most_recent_instance
+  return alert_fingerprint([
+    alert.tool.name, alert.tool.version, rule.name, rule.severity, rule.security_severity_level, rule.description,
+    instance.ref, instance.state, instance.location, instance.message['text']
+  ])
 
-  # Construct the issue title and body
-  issue_title = f"CodeQL Alert #{alert_id} - Security rule {rule_name} triggered"
+def render_codeql_body(alert, alert_url, fingerprint):
+  rule = alert.rule
+  instance = alert.most_recent_instance
   issue_body = f"""
-  **Tool**: {tool_name} ({tool_version})
-  **Rule**: {rule_name}
-  **Severity**: {rule_severity} (Security level: {rule_severity_level})
-  **Description**: {rule_description}
-  **Instance reference**: {recent_instance_ref}
-  **Instance state**: {recent_instance_state}
-  **Location**: {location}
-  **Message**: {message_text}
+  **Tool**: {alert.tool.name} ({alert.tool.version})
+  **Rule**: {rule.name}
+  **Severity**: {rule.severity} (Security level: {rule.security_severity_level})
+  **Description**: {rule.description}
+  **Instance reference**: {instance.ref}
+  **Instance state**: {instance.state}
+  **Location**: {instance.location}
+  **Message**: {instance.message['text']}
   """
+  return with_fingerprint(f"{issue_body}\n\n[CodeQL Alert Link]({alert_url})", fingerprint)
 
-  # Check if the issue already exists
-  issue_exists = any(issue.title == issue_title for issue in repo.get_issues(state="open"))
+def codeql_alert_url(alert_id):
+  return f"https://github.com/{owner}/{repo_name}/security/code-scanning/{alert_id}"
 
-  # If the issue already exists or the alert has been dismissed, skip it
-  if issue_exists or dismissed_at is not None:
-    scan_skipped_issues.append(alert_id)
+def codeql_fields(alert):
+  """ Normalized fields of a CodeQL alert, as exported """
+  rule_name = alert.rule.name
+  return {
+    "source": "codeql", "alert_number": alert.number, "state": alert.state,
+    "severity": convert_severity(str(alert.rule.security_severity_level)).title(),
+    "raw_severity": raw_severity(alert.rule.security_severity_level), "subject": rule_name,
+    "title": f"CodeQL Alert #{alert.number} - Security rule {rule_name} triggered", "url": codeql_alert_url(alert.number),
+    "created_at": export_timestamp(alert.created_at), "dismissed_at": export_timestamp(alert.dismissed_at),
+    "location": alert.most_recent_instance.location
+  }
+
+def process_codeql_alert(alert, alert_key):
+  """ Create or update the issue of an open CodeQL alert and return whether a new issue was created """
+  fields = codeql_fields(alert)
+  alert_id = alert.number
+  severity_label = get_severity_label(fields["severity"])
+  issue_title = fields["title"]
+  alert_url = fields["url"]
+
+  # Check if the issue already exists.  Existing issues are only edited when the alert changed.
+  existing_issue = open_issues.get(issue_title)
+  if existing_issue:
+    fingerprint = codeql_fingerprint(alert)
+    if issue_fingerprint(existing_issue) != fingerprint:
+      update_issue(existing_issue, render_codeql_body(alert, alert_url, fingerprint), severity_label)
+      scan_updated_issues.append(alert_id)
+    else:
+      scan_skipped_issues.append(alert_id)
   else:
     # Create a new issue
-    alert_url = f"https://github.com/{owner}/{repo_name}/security/code-scanning/{alert_id}"
     print(f"Severity: {severity_label} Labels: {custom_labels}")
-    repo.create_issue(
+    open_issues[issue_title] = repo.create_issue(
       title=issue_title,
-      body=f"{issue_body}\n\n[CodeQL Alert Link]({alert_url})",
+      body=render_codeql_body(alert, alert_url, codeql_fingerprint(alert)),
       labels=[severity_label] + custom_labels
     )
     scan_created_issues.append(alert_id)
+    run_state["created_issues"].append(open_issues[issue_title].number)
+
+  export_alert(open_issues[issue_title], **fields)
+  return existing_issue is None
+
+open_codeql_alerts = set()
+
+for alert in codescan_alerts:
+  alert_key = f"codeql:{alert.number}"
+  open_codeql_alerts.add(alert.number)
+  if alert_key in processed_alerts:
+    export_unprocessed_alert(alert_key, alert)
+    continue
+  enqueue_alert(severity_bucket(alert.rule.security_severity_level), alert_key, process_codeql_alert, alert)
+
+# Dispatch the queued alerts, most severe first, and record how long after the start of the run each new issue
+# was created
+time_to_issue = {bucket: [] for bucket in severity_buckets}
+# Why the run stopped early, if it did
+deferred_reason = None
+
+while alert_queue:
+  deferred_reason = out_of_budget()
+  if deferred_reason:
+    break
+  _, _, bucket, alert_key, handler, alert = heapq.heappop(alert_queue)
+  if handler(alert, alert_key):
+    time_to_issue[bucket].append(time.monotonic() - started_at)
+  finish_alert(alert_key)
+
+# Alerts deferred to the next run are still part of the export
+for _, _, bucket, alert_key, handler, alert in alert_queue:
+  export_unprocessed_alert(alert_key, alert)
+
+print(f"Created issue IDs: {dep_created_issues}")
+print(f"Updated issue IDs: {dep_updated_issues}")
+print(f"Skipped issue IDs: {dep_skipped_issues}")
+
+# Close the issues of CodeQL alerts that are no longer open.  Needs the complete list of open alerts, so it is
+# skipped when the run stopped early or the list was filtered.
+codeql_title_pattern = re.compile(r"CodeQL Alert #(\d+) - ")
+if not deferred_reason and not codeql_tool_name and not codeql_severity:
+  for issue_title in list(open_issues):
+    match = codeql_title_pattern.match(issue_title)
+    if not match or int(match.group(1)) in open_codeql_alerts:
+      continue
+    deferred_reason = out_of_budget()
+    if deferred_reason:
+      break
+    alert_id = int(match.group(1))
+    alert_key = f"codeql:{alert_id}"
+    alert_url = codeql_alert_url(alert_id)
+    existing_issue = open_issues[issue_title]
+    try:
+      # One call per closed issue, to tell fixed from dismissed alerts
+      alert = repo.get_codescan_alert(alert_id)
+    except UnknownObjectException:
+      # Alerts of a deleted analysis answer 404
+      queue_close(issue_title, f"Closing: [CodeQL alert #{alert_id}]({alert_url}) is no longer reported.", "completed",
+                  alert_key)
+      export_alert(existing_issue, source="codeql", alert_number=alert_id, state="removed", title=issue_title,
+                   url=alert_url)
+    else:
+      state_reason = "not_planned" if alert.dismissed_at is not None else "completed"
+      queue_close(issue_title, f"Closing: [CodeQL alert #{alert_id}]({alert_url}) is {alert.state}.", state_reason, alert_key)
+      export_alert(existing_issue, **codeql_fields(alert))
+    scan_skipped_issues.append(alert_id)
+    finish_alert(alert_key)
 
 print(f"Created issue IDs: {scan_created_issues}")
-print(f"Skipped issue IDs: {scan_skipped_issues}")
\ No newline at end of file
+print(f"Updated issue IDs: {scan_updated_issues}")
+print(f"Skipped issue IDs: {scan_skipped_issues}")
+
+# Close the issues of fixed and dismissed alerts, a few at a time to stay clear of the secondary rate limits
+closed_issues = []
+if issues_to_close:
+  with ThreadPoolExecutor(max_workers=close_concurrency) as executor:
+    closed_issues = list(executor.map(close_issue, issues_to_close))
+for issue, reason, state_reason, alert_key in issues_to_close:
+  pending_closes.discard(alert_key)
+  mark_processed(alert_key)
+
+print(f"Closed issue numbers: {closed_issues}")
+
+print("Time to new issue by severity:")
+for bucket in severity_buckets:
+  latencies = sorted(time_to_issue[bucket])
+  if not latencies:
+    continue
+  report = f"  {bucket}: {len(latencies)} new issues, median {latencies[len(latencies) // 2]:.1f}s, max {latencies[-1]:.1f}s"
+  slo = severity_slo_seconds.get(bucket)
+  if slo is not None:
+    missed = sum(1 for latency in latencies if latency > slo)
+    report += f", {missed} over the {slo}s objective"
+  print(report)
+  if slo is not None and missed:
+    print(f"Warning: {missed} {bucket} alerts got their issue later than {slo}s into the run")
+
+run_state["dependabot_done"] = not unfinished_dependabot
+
+if deferred_reason:
+  print(f"Stopped early because {deferred_reason}.  The remaining alerts are deferred to the next run.")
+else:
+  # Every alert was processed, the next run starts a new pass
+  run_state["complete"] = True
+save_state()
+close_exporter()
@@ -0,0 +1,283 @@
+"""PostgreSQL access layer
+
+Connections are pooled and reused instead of opening a new connection for every query. Settings come from the
+standard libpq environment variables:
+
+    PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD   connection parameters
+    PG_POOL_MIN, PG_POOL_MAX                         pool size (default 1 and 10)
+    PG_STATEMENT_TIMEOUT_MS                          server-side statement timeout (default 30000, 0 disables it)
+    PG_HEALTH_CHECK_SECONDS                          idle time after which a pooled connection is pinged before reuse
+
+An asyncio variant built on asyncpg is available through AsyncConnectionPool when asyncpg is installed.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+
+def db_config():
+    """ Read the database settings from the environment
+
+    Returns:
+        dict: connection parameters plus the pool and timeout settings
+
+    """
+
+    return {
+        'host': os.environ.get('PGHOST', 'localhost'),
+        'port': int(os.environ.get('PGPORT', '5432')),
+        'database': os.environ.get('PGDATABASE', 'postgres'),
+        'user': os.environ.get('PGUSER', 'postgres'),
+        'password': os.environ.get('PGPASSWORD'),
+        'min_size': int(os.environ.get('PG_POOL_MIN', '1')),
+        'max_size': int(os.environ.get('PG_POOL_MAX', '10')),
+        'statement_timeout_ms': int(os.environ.get('PG_STATEMENT_TIMEOUT_MS', '30000')),
+        'health_check_seconds': float(os.environ.get('PG_HEALTH_CHECK_SECONDS', '30')),
+    }
+
+
+class ConnectionPool:
+    """ Thread-safe pool of psycopg2 connections
+
+    Callers block until a connection is free instead of failing when the pool is exhausted. A connection that has
+    been idle for more than health_check_seconds is pinged before it is handed out, and broken connections are
+    discarded and replaced.
+
+    Args:
+        config (dict): settings as returned by db_config, read from the environment when omitted
+
+    """
+
+    def __init__(self, config=None):
+        config = config or db_config()
+        self.health_check_seconds = config['health_check_seconds']
+        options = f"-c statement_timeout={config['statement_timeout_ms']}"
+        self._pool = pool.ThreadedConnectionPool(
+            config['min_size'],
+            config['max_size'],
+            host=config['host'],
+            port=config['port'],
+            database=config['database'],
+            user=config['user'],
+            password=config['password'],
+            options=options
+        )
+        self._slots = threading.BoundedSemaphore(config['max_size'])
+        self._last_used = {}
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.health_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("select 1")
+            conn.rollback()
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding broken database connection: {e}")
+            return False
+        return True
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        # Every idle connection may have gone stale, e.g. after a database restart
+        while not self._is_healthy(conn):
+            self._release(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    def _release(self, conn, close=False):
+        if close or conn.closed:
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection for one transaction
+
+        The transaction is committed when the block exits normally and rolled back on error.
+
+        Yields:
+            connection: psycopg2 connection
+
+        """
+
+        with self._slots:
+            conn = self._checkout()
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except psycopg2.OperationalError:
+                broken = True
+                raise
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._release(conn, close=broken)
+
+    def fetch_one(self, query, params=None):
+        """ Run a query and return its first row """
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+    def fetch_all(self, query, params=None):
+        """ Run a query and return all rows """
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def execute(self, query, params=None):
+        """ Run a statement and return the number of affected rows """
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+    def stream(self, query, params=None, batch_size=1000):
+        """ Stream the rows of a query through a server-side cursor
+
+        Only batch_size rows are held in memory at a time. The connection stays checked out until the generator
+        is exhausted or closed.
+
+        Args:
+            query (string): SQL query
+            params: query parameters
+            batch_size (int): number of rows fetched from the server per round trip
+        Yields:
+            tuple: one row at a time
+
+        """
+
+        with self.connection() as conn:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                yield from cursor
+
+    def healthy(self):
+        """ Check that the database answers
+
+        Returns:
+            bool: True if a pooled connection could run a query
+
+        """
+
+        try:
+            return self.fetch_one("select 1") == (1,)
+        except psycopg2.Error as e:
+            logger.error(f"Database health check failed: {e}")
+            return False
+
+    def close(self):
+        """ Close every connection of the pool """
+        self._pool.closeall()
+        self._last_used.clear()
+
+
+class AsyncConnectionPool:
+    """ asyncio pool of asyncpg connections
+
+    Use open() before the first query, or the pool as an async context manager.
+
+    Args:
+        config (dict): settings as returned by db_config, read from the environment when omitted
+    Raises:
+        RuntimeError: If asyncpg is not installed
+
+    """
+
+    def __init__(self, config=None):
+        if asyncpg is None:
+            raise RuntimeError("AsyncConnectionPool requires the asyncpg package")
+        self.config = config or db_config()
+        self._pool = None
+
+    async def open(self):
+        config = self.config
+        self._pool = await asyncpg.create_pool(
+            host=config['host'],
+            port=config['port'],
+            database=config['database'],
+            user=config['user'],
+            password=config['password'],
+            min_size=config['min_size'],
+            max_size=config['max_size'],
+            max_inactive_connection_lifetime=config['health_check_seconds'] * 10,
+            server_settings={'statement_timeout': str(config['statement_timeout_ms'])}
+        )
+        return self
+
+    async def close(self):
+        await self._pool.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        """ Borrow a connection for one transaction """
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def fetch_one(self, query, *args):
+        """ Run a query and return its first row """
+        async with self.connection() as conn:
+            return await conn.fetchrow(query, *args)
+
+    async def fetch_all(self, query, *args):
+        """ Run a query and return all rows """
+        async with self.connection() as conn:
+            return await conn.fetch(query, *args)
+
+    async def stream(self, query, *args, batch_size=1000):
+        """ Stream the rows of a query through a server-side cursor, batch_size rows per round trip """
+        async with self.connection() as conn:
+            async for row in conn.cursor(query, *args, prefetch=batch_size):
+                yield row
+
+    async def healthy(self):
+        """ Check that the database answers """
+        try:
+            return await self.fetch_one("select 1") is not None
+        except (asyncpg.PostgresError, OSError) as e:
+            logger.error(f"Database health check failed: {e}")
+            return False
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Return the process-wide connection pool, creating it on first use """
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ConnectionPool()
+    return _default_pool
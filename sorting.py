@@ -0,0 +1,173 @@
+"""Sorting utilities
+
+Replacement for the recursive insertion sort in testfile.py, which is O(n^2) and recurses once per element.
+All functions sort in place:
+
+    binary_insertion_sort   iterative insertion sort with binary search, for small or nearly sorted lists
+    merge_sort              adaptive merge sort over natural runs, for large lists
+    numpy_sort              NumPy stable sort, for numeric lists and arrays (needs numpy)
+    sort_in_place           keeps the (arr, n) call signature of insertionSortRecursive
+
+binary_insertion_sort and merge_sort are the pure Python versions of the strategy behind list.sort (Timsort).
+benchmarks/bench_sorting.py shows list.sort is an order of magnitude faster on every ordering, so sort_in_place
+uses it for lists and only switches to NumPy for NumPy arrays, where the data never has to leave the array.
+NumPy is only imported by numpy_sort, so sorting a list never loads it.
+"""
+
+import sys
+from bisect import bisect_right
+
+# Runs shorter than this are extended with binary insertion before merging
+min_run = 32
+
+
+def binary_insertion_sort(arr, lo=0, hi=None, start=None):
+    """ Sort arr[lo:hi] in place with binary insertion
+
+    Args:
+        arr (list): list to sort
+        lo (int): first index of the range
+        hi (int): end of the range, len(arr) when omitted
+        start (int): index of the first element not yet known to be in order, lo + 1 when omitted
+
+    """
+
+    if hi is None:
+        hi = len(arr)
+    for i in range(start or lo + 1, hi):
+        item = arr[i]
+        pos = bisect_right(arr, item, lo, i)
+        if pos != i:
+            # Shift arr[pos:i] one slot to the right in a single slice assignment
+            arr[pos + 1:i + 1] = arr[pos:i]
+            arr[pos] = item
+
+
+def _count_run(arr, lo, hi):
+    """ Return the end of the natural run starting at lo, reversing it first if it is strictly descending """
+    run_hi = lo + 1
+    if run_hi == hi:
+        return hi
+    if arr[run_hi] < arr[lo]:
+        while run_hi < hi and arr[run_hi] < arr[run_hi - 1]:
+            run_hi += 1
+        arr[lo:run_hi] = arr[lo:run_hi][::-1]
+    else:
+        while run_hi < hi and not arr[run_hi] < arr[run_hi - 1]:
+            run_hi += 1
+    return run_hi
+
+
+def _merge(arr, lo, mid, hi):
+    """ Merge the sorted ranges arr[lo:mid] and arr[mid:hi] in place """
+    # Already in order: the common case for nearly sorted input
+    if not arr[mid] < arr[mid - 1]:
+        return
+    left = arr[lo:mid]
+    i, j, k = 0, mid, lo
+    left_len = len(left)
+    while i < left_len and j < hi:
+        if arr[j] < left[i]:
+            arr[k] = arr[j]
+            j += 1
+        else:
+            arr[k] = left[i]
+            i += 1
+        k += 1
+    if i < left_len:
+        arr[k:k + left_len - i] = left[i:]
+
+
+def merge_sort(arr, lo=0, hi=None):
+    """ Sort arr[lo:hi] in place with an adaptive, stable merge sort
+
+    The input is split into natural ascending runs (descending runs are reversed). Runs shorter than min_run are
+    extended with binary insertion, then adjacent runs are merged pairwise until one run is left. Sorted and
+    reverse sorted inputs take linear time.
+
+    Args:
+        arr (list): list to sort
+        lo (int): first index of the range
+        hi (int): end of the range, len(arr) when omitted
+
+    """
+
+    if hi is None:
+        hi = len(arr)
+    if hi - lo < 2:
+        return
+
+    runs = []
+    start = lo
+    while start < hi:
+        end = _count_run(arr, start, hi)
+        if end - start < min_run:
+            forced_end = min(start + min_run, hi)
+            binary_insertion_sort(arr, start, forced_end, end)
+            end = forced_end
+        runs.append(start)
+        start = end
+    runs.append(hi)
+
+    while len(runs) > 2:
+        merged = []
+        for i in range(0, len(runs) - 1, 2):
+            merged.append(runs[i])
+            if i + 2 < len(runs):
+                _merge(arr, runs[i], runs[i + 1], runs[i + 2])
+        merged.append(hi)
+        runs = merged
+
+
+def numpy_sort(arr, lo=0, hi=None):
+    """ Sort the numeric range arr[lo:hi] in place with NumPy's stable sort
+
+    NumPy arrays are sorted through a view without copying. Lists are converted to an array and written back.
+
+    Args:
+        arr (list or numpy.ndarray): ints or floats
+        lo (int): first index of the range
+        hi (int): end of the range, len(arr) when omitted
+    Raises:
+        RuntimeError: If numpy is not installed
+        TypeError: If the range does not hold plain numbers
+
+    """
+
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("numpy_sort requires the numpy package") from None
+    if hi is None:
+        hi = len(arr)
+    if isinstance(arr, np.ndarray):
+        if arr.dtype.kind not in 'iuf':
+            raise TypeError(f"numpy_sort needs int or float values, got dtype {arr.dtype}")
+        arr[lo:hi].sort(kind='stable')
+        return
+    values = np.asarray(arr[lo:hi])
+    if values.dtype.kind not in 'iuf':
+        raise TypeError(f"numpy_sort needs int or float values, got dtype {values.dtype}")
+    values.sort(kind='stable')
+    arr[lo:hi] = values.tolist()
+
+
+def sort_in_place(arr, n=None):
+    """ Sort the first n elements of arr in place
+
+    Args:
+        arr (list or numpy.ndarray): sequence to sort
+        n (int): number of leading elements to sort, len(arr) when omitted
+
+    """
+
+    if n is None:
+        n = len(arr)
+    # An ndarray can only exist once numpy is imported, so a list is told apart without importing it
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(arr, np.ndarray):
+        numpy_sort(arr, 0, n)
+    elif n == len(arr):
+        arr.sort()
+    else:
+        arr[:n] = sorted(arr[:n])
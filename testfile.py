@@ -1,22 +1,11 @@
-import psycopg2
+from database import get_pool
+from sorting import sort_in_place
 
 def conn_to_db():
 
-  conn = psycopg2.connect(database = "tempdb", 
-                          user = "myuser", 
-                          host= 'test-db.aan0943.aws.amazon.com',
-                          password = "ns$nszure34",
-                          port = 5432)
-
-  cursor = conn.cursor()
-
-  cursor.execute("select version()")
-
-  data = cursor.fetchone()
+  data = get_pool().fetch_one("select version()")
   print("Connection established to: ",data)
 
-  conn.close()
-
 def inverted_star_pattern_recursive(height):
     if height > 0:
         print("*" * height)
@@ -26,24 +15,10 @@ height = 5
 inverted_star_pattern_recursive(height)
 
 def insertionSortRecursive(arr, n):
-    # base case
-    if n <= 1:
-        return
- 
-    # Sort first n-1 elements
-    insertionSortRecursive(arr, n - 1)
- 
-    # Insert last element at its correct position in sorted array.
-    last = arr[n - 1]
-    j = n - 2
- 
-    # Move elements of arr[0..i-1], that are
-    # greater than key, to one position ahead
-    # of their current position
-    while (j >= 0 and arr[j] > last):
-        arr[j + 1] = arr[j]
-        j = j - 1
-    arr[j + 1] = last
+    # Sort the first n elements of arr in place. The name and signature are
+    # kept for existing callers; sort_in_place picks an iterative algorithm,
+    # so large inputs no longer hit the recursion limit.
+    sort_in_place(arr, n)
  
  
 # Driver program to test insertion sort
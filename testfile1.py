@@ -1,23 +1,157 @@
-import boto3
+from __future__ import annotations
+
+import functools
 import logging
 import json
 import os
-import certifi
-from opensearchpy import OpenSearch, RequestsHttpConnection, exceptions
-
-# Reset logging configuration to enable proper tagging of the functions logs
-root = logging.getLogger()
-if root.handlers:
-    for handler in root.handlers:
-        root.removeHandler(handler)
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING
+
+# boto3 and opensearchpy are imported on first use, so that invocations returning early and the
+# Lambda init phase don't pay for modules they never touch
+if TYPE_CHECKING:
+    from opensearchpy import OpenSearch
+
+# Tag the function logs with the log level. The formatter is built once at import and attached to the
+# handler installed by the Lambda runtime instead of tearing down and rebuilding the root logging config.
 log_format = '%(levelname)s - %(message)s'
-logging.basicConfig(format=log_format, level=logging.INFO)
+log_formatter = logging.Formatter(log_format)
 logger = logging.getLogger()
+if logger.handlers:
+    for handler in logger.handlers:
+        handler.setFormatter(log_formatter)
+else:
+    logging.basicConfig(format=log_format)
 logger.setLevel(logging.INFO)
 
 security_api = '/_opendistro/_security/api'
-
-sm_client = boto3.client('secretsmanager')
+security_authinfo = '/_opendistro/_security/authinfo'
+
+# OpenSearch request budget: per-attempt timeout cap, shortest attempt worth starting, and the time kept in
+# reserve before the Lambda deadline for logging and returning a result
+max_attempt_timeout = float(os.environ.get('OPENSEARCH_ATTEMPT_TIMEOUT', '10'))
+min_attempt_timeout = 1.0
+deadline_margin = float(os.environ.get('DEADLINE_MARGIN_SECONDS', '2'))
+
+_sm_client = None
+_sm_client_lock = threading.Lock()
+
+def get_sm_client():
+    """ Return the Secrets Manager client, creating it on first use """
+    global _sm_client
+    if _sm_client is None:
+        with _sm_client_lock:
+            if _sm_client is None:
+                import boto3
+                _sm_client = boto3.client('secretsmanager')
+    return _sm_client
+
+def __getattr__(name):
+    # Keep 'testfile1.sm_client' working for callers of the module-level client
+    if name == 'sm_client':
+        return get_sm_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Bulk rotation limits: clusters rotated in parallel, and rotations in flight against a single cluster
+max_parallel_clusters = int(os.environ.get('MAX_PARALLEL_CLUSTERS', '8'))
+max_cluster_concurrency = int(os.environ.get('MAX_CLUSTER_CONCURRENCY', '4'))
+# Prefix of the version tokens created by bulk rotations, so an unfinished one can be told apart and resumed
+batch_token_prefix = 'batch-'
+
+# Per-call timings and success/failure counts, written to stdout as CloudWatch Embedded Metric Format (EMF)
+# JSON lines at the end of each invocation
+metrics_enabled = os.environ.get('ROTATION_METRICS', '').lower() in ('1', 'true', 'yes')
+metrics_namespace = os.environ.get('ROTATION_METRICS_NAMESPACE', 'OpenSearchRotation')
+# EMF accepts at most 100 values per metric in one log line
+emf_max_values = 100
+
+class RotationMetrics:
+    """ Collect call timings and success/failure counters for one invocation """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._timings = defaultdict(list)
+        self._counts = Counter()
+
+    @contextmanager
+    def timed(self, name, expected=()):
+        """ Time the wrapped call and count it as '<name>.Success' or '<name>.Failure'
+
+        Exceptions of the types in expected are answers rather than failures, such as the ResourceNotFound a probe
+        for a missing version gets, and are counted as '<name>.NotFound' instead.
+
+        """
+        start = time.perf_counter()
+        outcome = 'Failure'
+        try:
+            yield
+            outcome = 'Success'
+        except expected:
+            outcome = 'NotFound'
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._timings[f"{name}.Time"].append(elapsed_ms)
+                self._counts[f"{name}.{outcome}"] += 1
+
+    def flush(self, step):
+        """ Write the collected metrics as EMF lines with a 'Step' dimension and reset them """
+        with self._lock:
+            timings, counts = self._timings, self._counts
+            self._timings, self._counts = defaultdict(list), Counter()
+        if not timings and not counts:
+            return
+        chunks = max([len(values) for values in timings.values()] + [1])
+        for offset in range(0, chunks, emf_max_values):
+            record = {'Step': step}
+            definitions = []
+            for name, values in timings.items():
+                if values[offset:offset + emf_max_values]:
+                    record[name] = values[offset:offset + emf_max_values]
+                    definitions.append({'Name': name, 'Unit': 'Milliseconds'})
+            if offset == 0:
+                for name, count in counts.items():
+                    record[name] = count
+                    definitions.append({'Name': name, 'Unit': 'Count'})
+            record['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{'Namespace': self.namespace, 'Dimensions': [['Step']], 'Metrics': definitions}]
+            }
+            sys.stdout.write(json.dumps(record) + '\n')
+        sys.stdout.flush()
+
+class DisabledMetrics:
+    """ Stand-in for RotationMetrics when metrics are off, so instrumented calls cost next to nothing """
+
+    _null = nullcontext()
+
+    def timed(self, name, expected=()):
+        return self._null
+
+    def flush(self, step):
+        pass
+
+metrics = RotationMetrics(metrics_namespace) if metrics_enabled else DisabledMetrics()
+
+def emits_metrics(handler):
+    """ Time a Lambda handler invocation and flush the metrics it collected when it returns or raises """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        step = event.get('Step', 'batch')
+        try:
+            with metrics.timed('Invocation'):
+                return handler(event, context)
+        finally:
+            metrics.flush(step)
+    return wrapper
 
 class InvalidUserCredentials(Exception):
     """ Raise if connection to a cluster with user credentials failed """
@@ -25,6 +159,10 @@ class InvalidUserCredentials(Exception):
 class InvalidUserPermissions(Exception):
     """ Raise if connection to a cluster with user credentials failed """
 
+class DeadlineExceeded(Exception):
+    """ Raise if the Lambda time budget ran out before the cluster answered """
+
+@emits_metrics
 def lambda_handler(event, context):
     """Secrets Manager secret rotation for OpenSearch
     
@@ -52,12 +190,15 @@ def lambda_handler(event, context):
     arn = event['SecretId']
     token = event['ClientRequestToken']
     step = event['Step']
+    sm_client = get_sm_client()
+    deadline = get_deadline(context)
 
     logger.info(f"Secret: {arn}")
     logger.info(f"Rotation stage: {step}")
 
     # Make sure the version is staged correctly
-    metadata = sm_client.describe_secret(SecretId=arn)
+    with metrics.timed('SecretsManager.DescribeSecret'):
+        metadata = sm_client.describe_secret(SecretId=arn)
     if not metadata['RotationEnabled']:
         logger.error(f"Secret {arn} is not enabled for rotation")
         raise ValueError(f"Secret {arn} is not enabled for rotation")
@@ -75,9 +216,9 @@ def lambda_handler(event, context):
     if step == "createSecret":
         create_secret(sm_client, arn, token)
     elif step == "setSecret":
-        set_secret(sm_client, arn, token)
+        set_secret(sm_client, arn, token, deadline)
     elif step == "testSecret":
-        test_secret(sm_client, arn, token)
+        test_secret(sm_client, arn, token, deadline)
     elif step == "finishSecret":
         finish_secret(sm_client, arn, token)
     else:
@@ -106,26 +247,28 @@ def create_secret(sm_client, arn, token):
     
     # Check if the AWSPENDING version already exists by trying to retrieve it. If that fails, create a new secret version
     try:
-        get_secret_dict(sm_client, arn, "AWSPENDING", token)
+        get_secret_dict(sm_client, arn, "AWSPENDING", token, probe=True)
         logger.info(f"Successfully retrieved secret for {arn}.")
     except sm_client.exceptions.ResourceNotFoundException:
         # Get exclude characters from environment variable
         exclude_characters = os.environ['EXCLUDE_CHARACTERS'] if 'EXCLUDE_CHARACTERS' in os.environ else '/@"\'\\'
         # Generate a random password and update the secret with it
-        passwd = sm_client.get_random_password(ExcludeCharacters=exclude_characters)
+        with metrics.timed('SecretsManager.GetRandomPassword'):
+            passwd = sm_client.get_random_password(ExcludeCharacters=exclude_characters)
         secret_string = current_dict
         secret_string['password'] = passwd['RandomPassword']
         # Put the new secret version as Pending
-        sm_client.put_secret_value(
-            SecretId=arn,
-            ClientRequestToken=token,
-            SecretString=json.dumps(secret_string),
-            VersionStages=['AWSPENDING']
-        )
+        with metrics.timed('SecretsManager.PutSecretValue'):
+            sm_client.put_secret_value(
+                SecretId=arn,
+                ClientRequestToken=token,
+                SecretString=json.dumps(secret_string),
+                VersionStages=['AWSPENDING']
+            )
         logger.info(f"Successfully put secret for ARN {arn} and version {token}.")
 
 
-def set_secret(sm_client, arn, token):
+def set_secret(sm_client, arn, token, deadline=None):
     """Set the secret
     
     Connect to the OpenSearch cluster using the login and password value stored in the AWSCURRENT secret version
@@ -135,6 +278,9 @@ def set_secret(sm_client, arn, token):
         sm_client (client): The Secrets Manager service client
         arn (string): The secret ARN or other identifier
         token (string): The ClientRequestToken associated with the secret version.
+        deadline (float): time.monotonic() value by which the step must be done, see get_deadline
+    Raises:
+        DeadlineExceeded: If too little time is left to connect to the cluster or update the password
 
     """
 
@@ -142,26 +288,36 @@ def set_secret(sm_client, arn, token):
     current_dict = get_secret_dict(sm_client, arn, "AWSCURRENT")
 
     logger.info(f"Updating OpenSearch password for user \'{current_dict['login']}\', cluster \'{current_dict['endpoint']}\'")
-    opensearch_conn = opensearch_connect(current_dict['endpoint'], current_dict['login'], current_dict['password'])
+    opensearch_conn = opensearch_connect(current_dict['endpoint'], current_dict['login'], current_dict['password'], deadline)
     # Update the cluster user password with the value from the pending secret
-    update_opensearch_password(opensearch_conn, current_dict['login'], current_dict['password'], pending_dict['password'])
+    update_opensearch_password(opensearch_conn, current_dict['login'], current_dict['password'], pending_dict['password'],
+                               deadline)
 
 
-def test_secret(sm_client, arn, token):
+def test_secret(sm_client, arn, token, deadline=None):
     """ Test the secret
 
-    Connect to the OpenSearch cluster with the updated user password
+    Connect to the OpenSearch cluster with the updated user password and make one authenticated request
+    to prove the cluster accepts it
     
     Args:
         sm_client (client): The Secrets Manager service client
         arn (string): The secret ARN or other identifier
         token (string): The ClientRequestToken associated with the secret version
+        deadline (float): time.monotonic() value by which the step must be done, see get_deadline
+    Raises:
+        InvalidUserCredentials: If the cluster rejected the AWSPENDING credentials
+        InvalidUserPermissions: If the AWSPENDING user is not allowed to query its own account
+        DeadlineExceeded: If the cluster did not answer within the remaining time budget
 
     """
     
     pending_dict = get_secret_dict(sm_client, arn, "AWSPENDING", token)
     try:
-        opensearch_connect(pending_dict['endpoint'], pending_dict['login'], pending_dict['password'])
+        client = opensearch_connect(pending_dict['endpoint'], pending_dict['login'], pending_dict['password'], deadline)
+        if isinstance(client, str):
+            raise InvalidUserCredentials(f"Unable to connect to cluster '{pending_dict['endpoint']}': {client}")
+        verify_opensearch_credentials(client, deadline)
     except:
         logger.critical(f"ERROR - failed to update the OpenSearch credentials and secret for user \'{pending_dict['login']}\'")
         raise
@@ -180,7 +336,8 @@ def finish_secret(sm_client, arn, token):
 
     """
     # First describe the secret to get the current version
-    metadata = sm_client.describe_secret(SecretId=arn)
+    with metrics.timed('SecretsManager.DescribeSecret'):
+        metadata = sm_client.describe_secret(SecretId=arn)
     current_version = None
     for version in metadata["VersionIdsToStages"]:
         if "AWSCURRENT" in metadata["VersionIdsToStages"][version]:
@@ -191,14 +348,243 @@ def finish_secret(sm_client, arn, token):
             current_version = version
             break
     # Finalize by staging the secret version current
-    sm_client.update_secret_version_stage(SecretId=arn, VersionStage="AWSCURRENT", MoveToVersionId=token, RemoveFromVersionId=current_version)
+    with metrics.timed('SecretsManager.UpdateSecretVersionStage'):
+        sm_client.update_secret_version_stage(SecretId=arn, VersionStage="AWSCURRENT", MoveToVersionId=token, RemoveFromVersionId=current_version)
     current_dict = get_secret_dict(sm_client, arn, "AWSCURRENT")
     msg = f"Successfully updated the OpenSearch credentials and secret for the user \'{current_dict['login']}\'."
     logger.info(msg)
 
+@emits_metrics
+def batch_lambda_handler(event, context):
+    """Bulk Secrets Manager secret rotation for OpenSearch
+
+    Rotates many OpenSearch credential secrets in one invocation instead of one Lambda run per secret. The secrets
+    are grouped by cluster endpoint and each secret goes through the createSecret, setSecret, testSecret and
+    finishSecret steps. Clusters are rotated in parallel and at most MaxConcurrencyPerCluster rotations run against
+    the same cluster at any time.
+
+    Secrets that are not enabled for rotation, or that already have an AWSPENDING version from a rotation Secrets
+    Manager started, are skipped instead of having that rotation taken over. An AWSPENDING version left by an
+    earlier bulk rotation (token starting with batch_token_prefix) is resumed instead. No rotation is started, and
+    no password is written, once the deadline is too close; the AWSPENDING stage of a rotation that failed before
+    its password write is removed again.
+
+    If a secret's 'master_secret' key holds the ARN of the cluster admin secret, the admin connection is opened once
+    per cluster and reused to set the password of every user secret. Admin secrets ('master_secret' set to 'self')
+    are rotated last so that the shared admin connection stays valid for the rest of the cluster.
+
+    Args:
+        event (dict): Lambda dictionary of event parameters. These keys are supported:
+            - SecretIds: List of secret ARNs or identifiers to rotate
+            - MaxConcurrencyPerCluster (optional): Cap on concurrent rotations per cluster
+        context (LambdaContext): The Lambda runtime information
+
+    Returns:
+        list: One result dictionary per secret with the keys 'SecretId', 'Endpoint', 'Token', 'Status' and 'Error'.
+            'Status' is 'Rotated', 'Failed' or 'Skipped', 'Error' holds the failure or skip reason
+
+    Raises:
+        KeyError: If the event parameters do not contain the expected keys
+
+    """
+
+    arns = list(dict.fromkeys(event['SecretIds']))
+    sm_client = get_sm_client()
+    cluster_concurrency = int(event.get('MaxConcurrencyPerCluster', max_cluster_concurrency))
+    deadline = get_deadline(context)
+
+    logger.info(f"Bulk rotation of {len(arns)} secrets")
+
+    # Group the secrets by cluster endpoint
+    results = {}
+    clusters = {}
+    for arn in arns:
+        try:
+            with metrics.timed('SecretsManager.DescribeSecret'):
+                metadata = sm_client.describe_secret(SecretId=arn)
+        except Exception as e:
+            logger.error(f"Unable to describe secret {arn}: {e}")
+            results[arn] = batch_result(arn, None, None, e)
+            continue
+        skip_reason = rotation_skip_reason(metadata)
+        if skip_reason:
+            logger.warning(f"Skipping secret {arn}: {skip_reason}")
+            results[arn] = batch_result(arn, None, None, skip_reason=skip_reason)
+            continue
+        resume_token = pending_batch_version(metadata)
+        if resume_token:
+            logger.info(f"Resuming the bulk rotation of secret {arn} with version {resume_token}")
+        try:
+            current_dict = get_secret_dict(sm_client, arn, "AWSCURRENT")
+        except Exception as e:
+            logger.error(f"Unable to read the current version of secret {arn}: {e}")
+            results[arn] = batch_result(arn, None, None, e)
+            continue
+        clusters.setdefault(current_dict['endpoint'], []).append((arn, current_dict, resume_token))
+
+    if clusters:
+        with ThreadPoolExecutor(max_workers=min(len(clusters), max_parallel_clusters)) as executor:
+            futures = [executor.submit(rotate_cluster, endpoint, secrets, cluster_concurrency, deadline)
+                       for endpoint, secrets in clusters.items()]
+            for future in futures:
+                results.update(future.result())
+
+    statuses = [results[arn]['Status'] for arn in arns]
+    logger.info(f"Bulk rotation finished: {statuses.count('Rotated')} rotated, {statuses.count('Failed')} failed, "
+                f"{statuses.count('Skipped')} skipped")
+    return [results[arn] for arn in arns]
+
+
+def rotate_cluster(endpoint, secrets, cluster_concurrency, deadline=None):
+    """Rotate all secrets of one OpenSearch cluster
+
+    Args:
+        endpoint (string): OpenSearch cluster endpoint
+        secrets (list): (arn, current secret dictionary, token to resume or None) for each secret of the cluster
+        cluster_concurrency (int): Maximum number of rotations in flight against the cluster
+        deadline (float): time.monotonic() value by which the rotations must be done, see get_deadline
+    Returns:
+        dict: Result dictionaries keyed by secret ARN
+
+    """
+
+    sm_client = get_sm_client()
+    admin_conns = {}
+    admin_lock = threading.Lock()
+
+    def get_admin_conn(admin_arn):
+        # Open each admin connection only once, even when several workers ask for it at the same time
+        with admin_lock:
+            if admin_arn not in admin_conns:
+                try:
+                    admin_dict = get_secret_dict(sm_client, admin_arn, "AWSCURRENT")
+                    conn = opensearch_connect(endpoint, admin_dict['login'], admin_dict['password'], deadline)
+                except Exception as e:
+                    logger.error(f"Unable to use admin secret {admin_arn} for cluster '{endpoint}': {e}")
+                    conn = None
+                admin_conns[admin_arn] = None if isinstance(conn, str) else conn
+            return admin_conns[admin_arn]
+
+    def rotate(item):
+        arn, current_dict, resume_token = item
+        admin_arn = current_dict.get('master_secret')
+        token = resume_token or f"{batch_token_prefix}{uuid.uuid4()}"
+        version_created = password_write_started = False
+        try:
+            # Don't start a rotation that has no time left to finish
+            attempt_timeout(deadline)
+            admin_conn = get_admin_conn(admin_arn) if admin_arn and admin_arn != 'self' else None
+            create_secret(sm_client, arn, token)
+            version_created = True
+            attempt_timeout(deadline)
+            password_write_started = True
+            if admin_conn is not None:
+                set_secret_as_admin(sm_client, arn, token, admin_conn, deadline)
+            else:
+                set_secret(sm_client, arn, token, deadline)
+            test_secret(sm_client, arn, token, deadline)
+            finish_secret(sm_client, arn, token)
+        except Exception as e:
+            logger.error(f"Rotation of secret {arn} failed: {e}")
+            # The cluster may hold the AWSPENDING password once the write started, the version is then kept for
+            # the next bulk rotation to resume
+            if version_created and not password_write_started and not resume_token:
+                discard_pending_version(sm_client, arn, token)
+            return arn, batch_result(arn, endpoint, token, e)
+        return arn, batch_result(arn, endpoint, token)
+
+    user_secrets = [item for item in secrets if item[1].get('master_secret') != 'self']
+    admin_secrets = [item for item in secrets if item[1].get('master_secret') == 'self']
+
+    logger.info(f"Rotating {len(secrets)} secrets on cluster '{endpoint}'")
+    with ThreadPoolExecutor(max_workers=max(1, cluster_concurrency)) as executor:
+        results = dict(executor.map(rotate, user_secrets))
+    # Changing an admin password invalidates the shared admin connection, so do it after the user secrets
+    results.update(rotate(item) for item in admin_secrets)
+    return results
+
+
+def set_secret_as_admin(sm_client, arn, token, admin_conn, deadline=None):
+    """Set the secret through an admin connection
+
+    Update the OpenSearch password of the secret user to the AWSPENDING value using an already opened cluster
+    admin connection, instead of connecting as the user itself.
+
+    Args:
+        sm_client (client): The Secrets Manager service client
+        arn (string): The secret ARN or other identifier
+        token (string): The ClientRequestToken associated with the secret version
+        admin_conn (OpenSearch): Client connected to the cluster with admin credentials
+        deadline (float): time.monotonic() value by which the step must be done, see get_deadline
+    Raises:
+        DeadlineExceeded: If too little time is left to write the password
+
+    """
+
+    pending_dict = get_secret_dict(sm_client, arn, "AWSPENDING", token)
+    attempt_timeout(deadline)
+    logger.info(f"Updating OpenSearch password for user \'{pending_dict['login']}\', cluster \'{pending_dict['endpoint']}\' as admin")
+    set_opensearch_user_password(admin_conn, pending_dict['login'], pending_dict['password'], deadline)
+
+
+def pending_batch_version(metadata):
+    """ Get the AWSPENDING version an earlier bulk rotation left unfinished
+
+    Args:
+        metadata (dict): describe_secret response of the secret
+    Returns:
+        string: Token of the version to resume, or None
+
+    """
+
+    for version, stages in metadata.get('VersionIdsToStages', {}).items():
+        if version.startswith(batch_token_prefix) and 'AWSPENDING' in stages and 'AWSCURRENT' not in stages:
+            return version
+    return None
+
+def discard_pending_version(sm_client, arn, token):
+    """ Remove the AWSPENDING stage from a version whose password never reached the cluster """
+    try:
+        with metrics.timed('SecretsManager.UpdateSecretVersionStage'):
+            sm_client.update_secret_version_stage(SecretId=arn, VersionStage="AWSPENDING", RemoveFromVersionId=token)
+    except Exception as e:
+        logger.error(f"Unable to remove the AWSPENDING stage from version {token} of secret {arn}: {e}")
+
+def rotation_skip_reason(metadata):
+    """ Get the reason a bulk rotation must leave a secret alone
+
+    Args:
+        metadata (dict): describe_secret response of the secret
+    Returns:
+        string: Why the secret is skipped, or None if it can be rotated
+
+    """
+
+    if not metadata.get('RotationEnabled'):
+        return "rotation is not enabled"
+    for version, stages in metadata.get('VersionIdsToStages', {}).items():
+        # A new AWSPENDING version would take the stage away from the rotation already in progress
+        if 'AWSPENDING' in stages and 'AWSCURRENT' not in stages and not version.startswith(batch_token_prefix):
+            return f"rotation already in progress with version {version}"
+    return None
+
+def batch_result(arn, endpoint, token, error=None, skip_reason=None):
+    """ Build the bulk rotation result entry for a secret """
+    if skip_reason:
+        status = 'Skipped'
+    else:
+        status = 'Failed' if error else 'Rotated'
+    return {
+        'SecretId': arn,
+        'Endpoint': endpoint,
+        'Token': token,
+        'Status': status,
+        'Error': skip_reason or (str(error) if error else None)
+    }
+
 """ Helper functions """
 
-def get_secret_dict(sm_client, arn, stage, token=None):
+def get_secret_dict(sm_client, arn, stage, token=None, probe=False):
     """ Get secret value dictionary
     
     Args:
@@ -206,17 +592,20 @@ def get_secret_dict(sm_client, arn, stage, token=None):
         arn (string): The secret ARN or other identifier
         stage: Secret version stage
         token (string): The ClientRequestToken associated with the secret version
+        probe (bool): The version may not exist yet, a ResourceNotFoundException is then counted as NotFound
     Raises:
         KeyError: If the secret dictionary does not contain the required keys
 
     """
 
     required_fields = ['endpoint', 'login', 'password']
+    expected = (sm_client.exceptions.ResourceNotFoundException,) if probe else ()
     # Only do VersionId validation against the stage if a token is passed in
-    if token:
-        secret = sm_client.get_secret_value(SecretId=arn, VersionId=token, VersionStage=stage)
-    else:
-        secret = sm_client.get_secret_value(SecretId=arn, VersionStage=stage)
+    with metrics.timed('SecretsManager.GetSecretValue', expected):
+        if token:
+            secret = sm_client.get_secret_value(SecretId=arn, VersionId=token, VersionStage=stage)
+        else:
+            secret = sm_client.get_secret_value(SecretId=arn, VersionStage=stage)
     secret_dict = json.loads(secret['SecretString'])
     # Run validations against the secret
     for field in required_fields:
@@ -225,25 +614,68 @@ def get_secret_dict(sm_client, arn, stage, token=None):
     # Parse and return the secret JSON string
     return secret_dict
 
-def opensearch_connect(host: str, user: str, password: str):
+def get_deadline(context):
+    """ Get the deadline of the current invocation
+
+    Args:
+        context (LambdaContext): The Lambda runtime information, or None outside of Lambda
+    Returns:
+        float: time.monotonic() value by which OpenSearch calls must be done, or None if there is no time limit
+
+    """
+
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - deadline_margin
+
+def attempt_timeout(deadline):
+    """ Get the timeout for the next OpenSearch request
+
+    Args:
+        deadline: time.monotonic() value by which the request must be done, or None
+    Returns:
+        float: request timeout in seconds, capped at max_attempt_timeout and at the time left before the deadline
+    Raises:
+        DeadlineExceeded: If less than min_attempt_timeout is left before the deadline
+
+    """
+
+    if deadline is None:
+        return max_attempt_timeout
+    remaining = deadline - time.monotonic()
+    if remaining < min_attempt_timeout:
+        raise DeadlineExceeded(f"Only {max(remaining, 0):.1f}s left before the Lambda deadline")
+    return min(max_attempt_timeout, remaining)
+
+def opensearch_connect(host: str, user: str, password: str, deadline: float = None):
     """ Connect to the OpenSearch cluster
 
     Args:
-        host: cluster hostname
+        host: cluster hostname, optionally followed by ':port' (443 by default)
         user: cluster login
         password: user password
-    
+        deadline: time.monotonic() value bounding the requests made with the client, see get_deadline
+    Raises:
+        DeadlineExceeded: If less than min_attempt_timeout is left before the deadline
+
     """
 
+    from opensearchpy import OpenSearch, RequestsHttpConnection, exceptions
+
     logger.info(f"Connecting to OpenSearch domain endpoint '{host}' as '{user}'")
+    hostname, _, port = host.partition(':')
+    # Outside the try, so DeadlineExceeded reaches the caller instead of turning into a failed connection
+    timeout = attempt_timeout(deadline)
     try:
         client = OpenSearch(
-            hosts = [{'host': host, 'port': 443}],
+            hosts = [{'host': hostname, 'port': int(port or 443)}],
             http_auth = (user, password),
             use_ssl = True,
             verify_certs = True,
             connection_class = RequestsHttpConnection,
-            timeout=60
+            timeout = timeout,
+            # Requests are retried within the deadline by retry_opensearch_request instead
+            max_retries = 0
             )
     except exceptions.AuthenticationException as e:
         logger.error(e)
@@ -258,14 +690,91 @@ def opensearch_connect(host: str, user: str, password: str):
         logger.info("Success!")
         return client
 
-def update_opensearch_password(client: OpenSearch, user: str, old_password: str, new_password: str):
+def verify_opensearch_credentials(client: OpenSearch, deadline: float = None):
+    """ Prove the client credentials work with one authenticated request
+
+    The security plugin 'authinfo' endpoint is queried with a per-attempt timeout that fits in the time left.
+    Connection errors, timeouts and server errors are retried with backoff for as long as the deadline allows;
+    without a deadline a single attempt is made.
+
+    Args:
+        client: OpenSearch client object
+        deadline: time.monotonic() value by which the check must be done, see get_deadline
+    Raises:
+        InvalidUserCredentials: If the cluster rejected the credentials
+        InvalidUserPermissions: If the user is not allowed to call the authinfo endpoint
+        DeadlineExceeded: If no attempt succeeded before the deadline
+
+    """
+
+    from opensearchpy import exceptions
+
+    def authinfo(timeout):
+        with metrics.timed('OpenSearch.AuthInfo'):
+            client.transport.perform_request("GET", security_authinfo, params={'request_timeout': timeout})
+
+    try:
+        retry_opensearch_request(authinfo, deadline, "OpenSearch probe")
+    except exceptions.AuthenticationException as e:
+        raise InvalidUserCredentials(str(e)) from e
+    except exceptions.AuthorizationException as e:
+        raise InvalidUserPermissions(str(e)) from e
+    logger.info("Success - credentials verified")
+
+def retry_opensearch_request(request, deadline: float = None, description: str = "OpenSearch request"):
+    """ Run an OpenSearch request, retrying transient failures until the deadline
+
+    The client transport does not retry (see opensearch_connect), so connection errors, timeouts and server
+    errors are retried here with backoff for as long as the deadline allows, each attempt with a timeout that
+    fits in the time left. Without a deadline a single attempt is made.
+
+    Args:
+        request: Callable making one attempt, called with the per-attempt timeout in seconds
+        deadline: time.monotonic() value by which the request must be done, see get_deadline
+        description: What the request does, for the log and error messages
+    Returns:
+        The return value of the successful attempt
+    Raises:
+        TransportError: If the cluster answered with a 4xx error or a certificate problem, which won't go away on
+            retry, or if the only attempt failed
+        DeadlineExceeded: If no attempt succeeded before the deadline
+
+    """
+
+    from opensearchpy import exceptions
+
+    backoff = 0.5
+    while True:
+        timeout = attempt_timeout(deadline)
+        try:
+            return request(timeout)
+        except exceptions.SSLError:
+            # A certificate problem won't go away on retry
+            raise
+        except exceptions.TransportError as e:
+            # ConnectionError and ConnectionTimeout carry status 'N/A'; other 4xx answers won't change on retry
+            if isinstance(e.status_code, int) and e.status_code < 500:
+                raise
+            if deadline is None:
+                raise
+            if deadline - time.monotonic() < backoff + min_attempt_timeout:
+                raise DeadlineExceeded(f"OpenSearch did not answer before the Lambda deadline: {e}") from e
+            logger.warning(f"{description} failed, retrying in {backoff}s: {e}")
+            time.sleep(backoff)
+            backoff *= 2
+
+def update_opensearch_password(client: OpenSearch, user: str, old_password: str, new_password: str,
+                               deadline: float = None):
     """  Update OpenSearch user password
 
+    Transient failures are retried until the deadline, see retry_opensearch_request.
+
     Args:
         client: OpenSearch client object
         user: OpenSearch user name
         old_password: current password
         new_password: new password
+        deadline: time.monotonic() value by which the update must be done, see get_deadline
     
     """
 
@@ -275,18 +784,52 @@ def update_opensearch_password(client: OpenSearch, user: str, old_password: str,
         "password": new_password
     }
  
+    def change_password(timeout):
+        with metrics.timed('OpenSearch.ChangePassword'):
+            client.security.change_password(body=body, params={'request_timeout': timeout})
+
     try:
-        client.security.change_password(body=body)
+        # Failures are logged and swallowed here, the metrics still count them
+        retry_opensearch_request(change_password, deadline, f"Password update for user {user}")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(e)
     else:
         logger.info(f"Success - password updated")
 
+def set_opensearch_user_password(client: OpenSearch, user: str, new_password: str, deadline: float = None):
+    """  Set an OpenSearch internal user password with admin privileges
+
+    Transient failures are retried until the deadline, see retry_opensearch_request.
+
+    Args:
+        client: OpenSearch client object connected as a cluster admin
+        user: OpenSearch user name
+        new_password: new password
+        deadline: time.monotonic() value by which the update must be done, see get_deadline
+    Raises:
+        TransportError: If the cluster rejected the password update
+        DeadlineExceeded: If the update did not succeed before the deadline
+
+    """
+
+    logger.info(f'Setting password for user {user}')
+    body = [{"op": "replace", "path": "/password", "value": new_password}]
+
+    def patch_user(timeout):
+        with metrics.timed('OpenSearch.SetUserPassword'):
+            client.transport.perform_request("PATCH", f"{security_api}/internalusers/{user}", body=body,
+                                             params={'request_timeout': timeout})
+
+    retry_opensearch_request(patch_user, deadline, f"Password update for user {user}")
+    logger.info(f"Success - password set for user {user}")
+
 def delete_secret(secret):
     logger.info(f"Deleting the secret {secret}")
     days_to_recover = 30
     try:
-        sm_client.delete_secret(SecretId=secret, RecoveryWindowInDays=days_to_recover)
+        get_sm_client().delete_secret(SecretId=secret, RecoveryWindowInDays=days_to_recover)
     except Exception as e:
         return e
     else: